@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import subprocess
+import numpy as np
+
+##########################################################################
+## Benchmark of the scripts in this directory with synthetic fixtures.  ##
+## Every case runs in its own process. Wall time and peak memory (max   ##
+## RSS of that process) are recorded to a JSON file, which can be used  ##
+## as baseline of the next run (--compare) to catch regressions.        ##
+## -------------------------------------------------------------------- ##
+## $ python benchmark.py                        (quick : 100^3 grids)   ##
+## $ python benchmark.py --grids 100 200 300 400 500 -o baseline.json   ##
+## $ python benchmark.py --compare baseline.json                        ##
+##########################################################################
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+import vasp_grid
+
+
+#------------------------------------------------------------------
+# Synthetic fixtures
+#------------------------------------------------------------------
+def _structure_lines(cell, species, natoms, coord):
+    lines = ["Synthetic slab", "   1.00000000000000"]
+    lines += ["    %12.6f%12.6f%12.6f" % tuple(v) for v in cell]
+    lines += ["   " + "   ".join(species), "   " + "   ".join(map(str, natoms)), "Direct"]
+    lines += ["  %10.6f%10.6f%10.6f" % tuple(v) for v in coord]
+    return lines
+
+
+def make_volumetric(filename, n, spin=False, seed=0):
+    '''LOCPOT/CHGCAR like file with n x n x n grid. Slab in the middle of c, vacuum elsewhere.
+    spin=True : augmentation occupancies and a second (magnetization) grid, like spin-polarized CHGCAR.'''
+    rng = np.random.default_rng(seed)
+    natoms = [8, 4]
+    coord = rng.random((sum(natoms), 3)) * [1, 1, 0.3] + [0, 0, 0.35]
+    z = np.arange(n) / n
+    profile = np.where((z > 0.3) & (z < 0.7), -8.0, 4.2)
+    with open(filename, "wb") as f:
+        f.write(("\n".join(_structure_lines(np.diag([n * 0.1, n * 0.1, n * 0.2]), ["Pt", "O"], natoms, coord))
+                 + "\n\n  %d  %d  %d\n" % (n, n, n)).encode())
+        nblocks = 2 if spin else 1
+        for b in range(nblocks):
+            planes = (profile[k] + 0.01 * rng.standard_normal(n * n) if b == 0 else rng.standard_normal(n * n) for k in range(n))
+            vasp_grid.write_values(f, planes)
+            if spin:
+                for atom in range(sum(natoms)):
+                    f.write(b"augmentation occupancies %3d  18\n" % (atom + 1))
+                    vasp_grid.write_values(f, [rng.random(18)])
+                if b == 0:
+                    vasp_grid.write_values(f, [np.zeros(sum(natoms))])
+                    f.write(b"\n  %d  %d  %d\n" % (n, n, n))
+
+
+def make_cursave(filename, nx, ny, nz, seed=0):
+    '''CURSAVE of STM calculation. For each (x, y) : "x y" line, then nz lines of current.'''
+    rng = np.random.default_rng(seed)
+    decay = np.exp(-np.arange(nz) / (nz / 5.0))
+    with open(filename, "w") as f:
+        for ix in range(nx):
+            for iy in range(ny):
+                f.write("  %.6f   %.6f\n" % (ix * 0.1, iy * 0.1))
+                f.write("".join(" %.10E\n" % v for v in decay * (1 + 0.1 * rng.random(nz))))
+
+
+def make_outcar(filename, nsteps, natoms=32, nelm=60, seed=0):
+    '''OUTCAR with many ionic steps (keywords used by conv_check.py and gyp.py).'''
+    rng = np.random.default_rng(seed)
+    force = "".join("  %10.5f %10.5f %10.5f  %12.6f %12.6f %12.6f\n" % tuple(v)
+                    for v in rng.standard_normal((natoms, 6)))
+    with open(filename, "w") as f:
+        f.write("   number of dos      NEDOS =    301   number of ions     NIONS =     %d\n" % natoms)
+        f.write("   NELM   =     %d;   NELMIN=  2; NELMDL= -5     # of ELM steps\n" % nelm)
+        f.write("   EDIFF  = 0.1E-04   stopping-criterion for ELM\n")
+        energy = -100.0
+        for step in range(nsteps):
+            for it in range(5):
+                f.write("----------------------------------------- Iteration %4d(%4d)  ---------------------------------------\n" % (step + 1, it + 1))
+                f.write("      LOOP:  cpu time      1.2345: real time      1.2500\n")
+            energy -= 0.01 * rng.random()
+            f.write("  volume of cell :      %.2f\n" % 1234.56)
+            f.write(" number of electron     %.7f magnetization       %.7f\n" % (200.0, 0.0))
+            f.write(" E-fermi :  %8.4f     XC(G=0): -10.1234     alpha+bet :-12.3456\n" % (-1.5 + 0.01 * rng.random()))
+            f.write(" POSITION                                       TOTAL-FORCE (eV/Angst)\n")
+            f.write(" -----------------------------------------------------------------------------------\n")
+            f.write(force)
+            f.write("  free  energy   TOTEN  =      %.8f eV\n" % energy)
+
+
+def make_vasprun(filename, megabytes, nedos=3000):
+    '''vasprun.xml of an MD run with one <calculation> (energies, DOS with efermi) per step, about [megabytes] MB.'''
+    dos = "".join("       <r> %10.4f %12.4f %12.4f </r>\n" % (-10 + 0.01 * i, 0.5, 0.01 * i) for i in range(nedos))
+    with open(filename, "w") as f:
+        f.write('<?xml version="1.0" encoding="ISO-8859-1"?>\n<modeling>\n <incar>\n  <i name="NELM">60</i>\n </incar>\n')
+        step = 0
+        while f.tell() < megabytes * 1024**2:
+            e = -100 - 1E-4 * step
+            f.write(" <calculation>\n  <scstep>\n   <energy>\n    <i name=\"e_fr_energy\"> %16.8f </i>\n   </energy>\n  </scstep>\n" % e)
+            f.write("  <structure>\n   <crystal>\n    <i name=\"volume\"> %16.8f </i>\n   </crystal>\n  </structure>\n" % 500.0)
+            f.write("  <energy>\n   <i name=\"e_fr_energy\"> %16.8f </i>\n   <i name=\"e_wo_entrp\"> %16.8f </i>\n"
+                    "   <i name=\"e_0_energy\"> %16.8f </i>\n  </energy>\n" % (e, e - 0.1, e - 0.05))
+            f.write("  <dos>\n   <i name=\"efermi\"> %16.8f </i>\n   <total>\n    <array>\n     <set>\n" % (-1 - 1E-5 * step))
+            f.write(dos)
+            f.write("     </set>\n    </array>\n   </total>\n  </dos>\n </calculation>\n")
+            step += 1
+        f.write("</modeling>\n")
+
+
+def make_poscar(filename, natoms, seed=0):
+    rng = np.random.default_rng(seed)
+    species, counts = ["Pt", "O"], [natoms - natoms // 3, natoms // 3]
+    size = max(natoms ** (1 / 3.0) * 2.5, 5.0)
+    with open(filename, "w") as f:
+        f.write("\n".join(_structure_lines(np.diag([size] * 3), species, counts, rng.random((natoms, 3)))) + "\n")
+
+
+#------------------------------------------------------------------
+# Cases
+#------------------------------------------------------------------
+def cases(grids, cursaves, outcars, poscars, vaspruns=()):
+    '''[output] : [(name, fixture, command, setup command or None), ...]'''
+    py = sys.executable
+    nproc = str(os.cpu_count() or 1)
+    out = []
+    for n in grids:
+        loc, chg = "LOCPOT_%d" % n, "CHGCAR_%d" % n
+        lib = "import sys; sys.path.insert(0, %r); import vasp_grid, grid_cache, numpy as np; " % HERE
+        out += [
+            ("parse.read_grid[%d^3]" % n, loc, [py, "-c", lib + "vasp_grid.read_grid(%r)" % loc], None),
+            ("parse.read_grid_parallel[%d^3]" % n, loc, [py, "-c", lib + "vasp_grid.read_grid(%r, 0, %s)" % (loc, nproc)], None),
+            ("parse.magnetization_block[%d^3]" % n, chg, [py, "-c", lib + "vasp_grid.read_grid(%r, 1)" % chg], None),
+            ("average.stream_planar[%d^3]" % n, loc, [py, "-c", lib + "grid_cache.read_planar_averages(%r, False)" % loc], None),
+            ("write.format_values[%d^3]" % n, loc,
+             [py, "-c", lib + "vasp_grid.write_values(open('/dev/null', 'wb'), [np.random.default_rng(0).standard_normal(%d)])" % n**3], None),
+            ("gyp.py[%d^3]" % n, loc, [py, os.path.join(HERE, "gyp.py"), "-i", loc, "-fermi", "1", "--nocache"], None),
+            ("gyp.py --stream[%d^3]" % n, loc, [py, os.path.join(HERE, "gyp.py"), "-i", loc, "-fermi", "1", "--nocache", "--stream"], None),
+            ("gyp.py -d all[%d^3]" % n, loc, [py, os.path.join(HERE, "gyp.py"), "-i", loc, "-fermi", "1", "--nocache", "-d", "all"], None),
+            ("gyp.py cached[%d^3]" % n, loc, [py, os.path.join(HERE, "gyp.py"), "-i", loc, "-fermi", "1"],
+             [py, os.path.join(HERE, "gyp.py"), "-i", loc, "-fermi", "1"]),
+            ("ws_chg.py difference[3x%d^3]" % n, chg, [py, os.path.join(HERE, "ws_chg.py"), "-i", chg, chg, chg, "--nocache"], None),
+            ("ws_chg.py -S difference[3x%d^3]" % n, chg, [py, os.path.join(HERE, "ws_chg.py"), "-i", chg, chg, chg, "--nocache", "-S"], None),
+            ("ws_chg.py -p planar[%d^3]" % n, chg, [py, os.path.join(HERE, "ws_chg.py"), "-i", chg, "-p", "--nocache"], None),
+            ("ws_chg.py archive[%d^3]" % n, chg, [py, os.path.join(HERE, "ws_chg.py"), "-i", chg, "--nocache", "-o", "DCD.vgrid"], None),
+        ]
+    for (nx, ny, nz) in cursaves:
+        out.append(("c2c.py[%dx%dx%d]" % (nx, ny, nz), "CURSAVE_%dx%dx%d" % (nx, ny, nz),
+                    [py, os.path.join(HERE, "c2c.py"), str(nx), str(ny), str(nz)], None))
+        out.append(("c2c.py inferred grid[%dx%dx%d]" % (nx, ny, nz), "CURSAVE_%dx%dx%d" % (nx, ny, nz),
+                    [py, os.path.join(HERE, "c2c.py")], None))
+        out.append(("c2c.py -m 64[%dx%dx%d]" % (nx, ny, nz), "CURSAVE_%dx%dx%d" % (nx, ny, nz),
+                    [py, os.path.join(HERE, "c2c.py"), str(nx), str(ny), str(nz), "-m", "64", "--nocache"], None))
+    python2 = find_python2()
+    for n in outcars:
+        outcar = "OUTCAR_%d" % n
+        lib = "import sys; sys.path.insert(0, %r); import vasp_out; " % HERE
+        out.append(("conv_check.py[%d steps]" % n, outcar,
+                    [python2, os.path.join(HERE, "conv_check.py"), outcar] if python2 else None, None))
+        out.append(("vasp_out.last_values OUTCAR[%d steps]" % n, outcar, [py, "-c", lib + "vasp_out.last_values(%r)" % outcar], None))
+    for n in vaspruns:
+        xml = "vasprun_%d.xml" % n
+        lib = "import sys; sys.path.insert(0, %r); import vasp_out; " % HERE
+        out.append(("vasp_out.fermi_energy vasprun[%d MB]" % n, xml, [py, "-c", lib + "vasp_out.fermi_energy(%r)" % xml], None))
+        out.append(("vasp_out.vasprun_values stream[%d MB]" % n, xml,
+                    [py, "-c", lib + "vasp_out.vasprun_values(%r, tail=False)" % xml], None))
+    for n in poscars:
+        pos = "POSCAR_%d" % n
+        out.append(("dir2car.py[%d atoms]" % n, pos, [py, os.path.join(HERE, "dir2car.py"), pos], None))
+        out.append(("gycoco_new.py[%d atoms]" % n, pos, [py, os.path.join(HERE, "gycoco_new.py"), "-m", "1", "-f", pos], None))
+    return out
+
+
+def make_fixture(name, workdir, regen=False):
+    path = os.path.join(workdir, name)
+    if os.path.exists(path) and not regen:
+        return
+    kind, size = name.split("_")
+    if kind == "LOCPOT":
+        make_volumetric(path, int(size))
+    elif kind == "CHGCAR":
+        make_volumetric(path, int(size), spin=True)
+    elif kind == "CURSAVE":
+        make_cursave(path, *map(int, size.split("x")))
+    elif kind == "OUTCAR":
+        make_outcar(path, int(size))
+    elif kind == "POSCAR":
+        make_poscar(path, int(size))
+    elif kind == "vasprun":
+        make_vasprun(path, int(size[:-len(".xml")]))
+
+
+# Small launcher between this script and the measured command.
+# ru_maxrss of a process keeps the high-water mark of the process it was forked from (kept over exec),
+# so the command is forked from this launcher (few MB) instead of from the benchmark (numpy loaded).
+LAUNCHER = """
+import os, sys, time
+start = time.perf_counter()
+pid = os.fork()
+if pid == 0:
+    null = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(null, 1)
+    try:
+        os.execvp(sys.argv[2], sys.argv[2:])
+    finally:
+        os._exit(127)
+pid, status, usage = os.wait4(pid, 0)
+os.write(int(sys.argv[1]), b"%f %d %d" % (time.perf_counter() - start, usage.ru_maxrss, os.waitstatus_to_exitcode(status)))
+"""
+
+
+def run_case(command, workdir, timeout):
+    '''Run one command and measure it. Wall time and peak RSS are taken by os.wait4 in the launcher.
+    [output] : wall time (s), peak RSS (MB), return code, last line of stderr'''
+    rfd, wfd = os.pipe()
+    proc = subprocess.Popen([sys.executable, "-S", "-c", LAUNCHER, str(wfd)] + list(command), cwd=workdir,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, pass_fds=(wfd,), start_new_session=True)
+    os.close(wfd)
+    try:
+        stderr = proc.communicate(timeout=timeout)[1]
+    except subprocess.TimeoutExpired:
+        os.killpg(proc.pid, 9)
+        stderr = proc.communicate()[1]
+    with os.fdopen(rfd, "rb") as f:
+        measured = f.read().split()
+    err = stderr.decode(errors="replace").strip().splitlines()[-1:]
+    if len(measured) != 3:
+        return timeout, 0.0, -9, err or ["killed by timeout"]
+    return float(measured[0]), int(measured[1]) / 1024.0, int(measured[2]), err
+
+
+def find_python2():
+    '''[output] : command of a working python2 interpreter, or None (conv_check.py is written for python2)'''
+    for name in ("python2", "python2.7"):
+        path = shutil.which(name)
+        if path and subprocess.run([path, "-c", "pass"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0:
+            return path
+    return None
+
+
+def compare(results, baseline, tolerance):
+    '''[output] : list of regression messages'''
+    messages = []
+    for name, new in results.items():
+        old = baseline.get("results", {}).get(name)
+        if old is None or old.get("status") != "ok" or new.get("status") != "ok":
+            continue
+        for key, unit in (("wall", "s"), ("peak_rss_mb", "MB")):
+            if new[key] > old[key] * tolerance and new[key] - old[key] > (0.05 if key == "wall" else 5):
+                messages.append("%-45s %s %.3f%s -> %.3f%s (x%.2f)" % (name, key, old[key], unit, new[key], unit, new[key] / old[key]))
+    return messages
+
+
+def main():
+    pars = argparse.ArgumentParser(description="Benchmark of gyp.py, ws_chg.py, c2c.py, conv_check.py, dir2car.py, gycoco_new.py")
+    pars.add_argument("--grids", type=int, nargs="*", default=[100], help="Grid sizes (n for n^3) of LOCPOT/CHGCAR. default=100")
+    pars.add_argument("--cursave", type=str, nargs="*", default=["40x40x60"], help="CURSAVE grids as XxYxZ. default=40x40x60")
+    pars.add_argument("--outcar", type=int, nargs="*", default=[1000], help="Ionic steps of OUTCAR. default=1000")
+    pars.add_argument("--vasprun", type=int, nargs="*", default=[100], help="Size (MB) of vasprun.xml. default=100")
+    pars.add_argument("--poscar", type=int, nargs="*", default=[100, 1000, 10000, 100000], help="Atoms of POSCAR. default=10^2~10^5")
+    pars.add_argument("--full", action="store_true", help="Grids of 100^3 ~ 500^3 and larger CURSAVE/OUTCAR")
+    pars.add_argument("-k", type=str, default="", help="Run only cases whose name contains this text")
+    pars.add_argument("--repeat", type=int, default=1, help="Repeat each case and keep the fastest. default=1")
+    pars.add_argument("--timeout", type=float, default=3600, help="Timeout of one case (s)")
+    pars.add_argument("--workdir", type=str, default="bench_work", help="Directory of fixtures and outputs. default=bench_work")
+    pars.add_argument("--regen", action="store_true", help="Generate fixtures again even if they exist")
+    pars.add_argument("-o", type=str, default=None, help="Result file (JSON). default=[workdir]/bench_baseline.json")
+    pars.add_argument("--compare", type=str, default=None, help="Baseline JSON. Exit with 1 if a case is slower / larger than tolerance")
+    pars.add_argument("--tolerance", type=float, default=1.25, help="Allowed ratio to the baseline. default=1.25")
+    args = pars.parse_args()
+
+    if args.full:
+        args.grids = [100, 200, 300, 400, 500]
+        args.cursave = ["100x100x150", "300x300x400"]
+        args.outcar = [1000, 10000]
+        args.vasprun = [100, 2000]
+    cursaves = [tuple(map(int, x.split("x"))) for x in args.cursave]
+    os.makedirs(args.workdir, exist_ok=True)
+    if args.o is None:
+        args.o = os.path.join(args.workdir, "bench_baseline.json")
+
+    results = {}
+    for (name, fixture, command, setup) in cases(args.grids, cursaves, args.outcar, args.poscar, args.vasprun):
+        if args.k not in name:
+            continue
+        if command is None:
+            results[name] = {"status": "skipped", "reason": "interpreter not found"}
+            print("%-45s skipped (interpreter not found)" % name)
+            continue
+        t = time.perf_counter()
+        make_fixture(fixture, args.workdir, args.regen)
+        if fixture.startswith("CURSAVE"):
+            # c2c.py always reads ./CURSAVE
+            shutil.copyfile(os.path.join(args.workdir, fixture), os.path.join(args.workdir, "CURSAVE"))
+        if time.perf_counter() - t > 1:
+            print("%-45s (fixture %s : %.1f s)" % ("", fixture, time.perf_counter() - t))
+        if setup is not None:
+            run_case(setup, args.workdir, args.timeout)
+        best = None
+        for i in range(args.repeat):
+            wall, rss, code, err = run_case(command, args.workdir, args.timeout)
+            if best is None or wall < best[0]:
+                best = (wall, rss, code, err)
+        wall, rss, code, err = best
+        results[name] = {"status": "ok" if code == 0 else "failed", "wall": round(wall, 4), "peak_rss_mb": round(rss, 1)}
+        if code != 0:
+            results[name]["error"] = " ".join(err)
+        print("%-45s %9.3f s %9.1f MB  %s" % (name, wall, rss, "" if code == 0 else "FAILED " + " ".join(err)))
+
+    report = {"meta": {"date": time.strftime("%Y-%m-%d %H:%M:%S"), "python": platform.python_version(),
+                       "numpy": np.__version__, "machine": platform.machine(), "node": platform.node(),
+                       "cpus": os.cpu_count()},
+              "results": results}
+    with open(args.o, "w") as f:
+        json.dump(report, f, indent=1)
+    print("---- results are written in [ %s ] ----" % args.o)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            messages = compare(results, json.load(f), args.tolerance)
+        if messages:
+            print("---- Regressions against [ %s ] ----" % args.compare)
+            print("\n".join(messages))
+            sys.exit(1)
+        print("---- No regression against [ %s ] ----" % args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,85 +4,428 @@
 # Made by Taehun Lee.
 # Modified by Giyeok Lee, 2018/11/02
 # I think choosing gridpoints is more effecient in job file. So keep argparse
-import os, shutil, glob
-import math 
-import sys
+import os
+import glob
+import mmap
 import time
 import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+import vasp_grid
+import grid_cache
+import igor_itx
+import stm_image
 
+##########################################################################
+## CURSAVE (STM) -> CURRENT (VASP grid format)                          ##
+## CURSAVE : for each (x, y) (x slowest), one "x y" line then nz lines  ##
+##           of current. CURRENT : x fastest, z slowest.                ##
+## The whole file is parsed at once into (nx, ny, nz+2) numbers         ##
+## (x, y, current...), and CURRENT is written plane by plane from the   ##
+## transposed array.                                                    ##
+## Out-of-core (-m MB) : CURSAVE is converted once to a binary sidecar  ##
+## (.CURSAVE.c2c.npy), which is reordered in tiles of columns into      ##
+## blocks of z planes, so that memory stays under the budget.           ##
+## Before parsing, the grid is guessed from the layout (pre-flight) :   ##
+## nz+1 = spacing of "x y" lines, ny = number of them with the same x,  ##
+## nx = number of lines / (ny*(nz+1)), so X Y Z can be omitted.         ##
+## STM images (--height, --iso) are taken from the same read (stm_image)##
+## $ python c2c.py [X Y Z] [-m 2000] [--iso 1e-5 1e-6 -f png -j 4]      ##
+## Batch : every CURSAVE (or directory) is converted in its directory,  ##
+## with -j processes, and one summary is written (c2c_summary.txt).     ##
+## $ python c2c.py --batch bias_*/CURSAVE -j 20                         ##
+##########################################################################
 
-# Mady by GYLee
-s_t=time.time()
-pars = argparse.ArgumentParser()
-pars.add_argument('X', type = int, help='x grids')
-pars.add_argument('Y', type = int, help='y grids')
-pars.add_argument('Z', type = int, help='z grids')
-args  = pars.parse_args()
-nx = args.X
-ny = args.Y
-nz = args.Z
-fft_total = int(nx) * int(ny) * int(nz) 
-t_len=fft_total+int(nx)*int(ny)
-f = open("CURSAVE", 'r')
-resu=open("c2c_CAL_REPORT.txt",'w')
-CUR=open("CURRENT_temp",'w')
-xy=open('c2c_Real_xy_position.txt','w')
-sall = f.readlines()
-f.close()
-
-# Delete first line of CURSAVE when there is "Backup file" or something.
-try:
-    [float(x) for x in sall[0].rstrip("\n").split(" ") if x!=""]
-except:
-    sall=sall[1:]
-
-
-if len(sall)>=t_len and len(sall)<=t_len+2:
-    print("[good] (%s,%s,%s) is valid grid point numbers."%(nx,ny,nz),file=resu)
-    
-    # converter
-    for iz in range(0,nz+1):
-        for iy in range(1,ny+1):
-            for ix in range(1,nx+1):
-                temp=((ix-1)*ny+(iy-1))*(nz+1)+iz
-                a=sall[temp]
-
-                if iz!=0:
-                    print("%s"%a,file=CUR,end="")
-
-                else:
-                    xy_l=[float(x) for x in a.rstrip('\n').split(" ") if x!=""]
-                    print("%f   %f"%(xy_l[0], xy_l[1]), file=xy)
-        xy.close()
-    CUR.close()
-
-    ## rearrange CURRENT_temp to CURRENT <- from_TH
-    ftr = open('./CURRENT_temp')
-    ftr_split = [float(num) for num in ftr.read().split()];
-
-    save = open("CURRENT", "w")
-
-
-    if fft_total % 5 == 0:
-        for i in range(0, fft_total, 5):
-            print (str(ftr_split[i])+"   "+str(ftr_split[i+1])+"   "+str(ftr_split[i+2])+"   "+str(ftr_split[i+3])+"   "+str(ftr_split[i+4])+"   ",file=save)
+SUFFIX = "c2c"
+
+
+def is_numeric(line):
+    try:
+        [float(x) for x in line.split()]
+    except ValueError:
+        return False
+    return True
+
+
+def skip_header(fp):
+    '''Skip the first line of CURSAVE when there is "Backup file" or something.
+    [output] : number of skipped lines (0 or 1). fp is positioned at the first "x y" line.'''
+    line = fp.readline()
+    if is_numeric(line):
+        fp.seek(0)
+        return 0
+    return 1
+
+
+def _windows(fp, start, end, chunk_size=vasp_grid.CHUNK_SIZE):
+    '''Bytes of [start, end) of the file, [chunk_size] at a time.
+    Each chunk is read through its own small map, closed before the next one,
+    so that pages of the file do not stay resident (memory budget of -m).'''
+    grain = mmap.ALLOCATIONGRANULARITY
+    chunk_size = max(chunk_size - chunk_size % grain, grain)
+    pos = start
+    while pos < end:
+        base = pos - pos % grain
+        length = min(base + chunk_size, end) - base
+        with mmap.mmap(fp.fileno(), length, access=mmap.ACCESS_READ, offset=base) as mm:
+            data = mm[pos - base:]
+        yield data
+        pos = base + length
+
+
+def count_lines(fp, offset=0, chunk_size=vasp_grid.CHUNK_SIZE):
+    '''Number of lines (as readlines) of the file after [offset], by a newline scan of mapped windows'''
+    size = os.fstat(fp.fileno()).st_size
+    count, last = 0, b"\n"
+    for data in _windows(fp, offset, size, chunk_size):
+        count += data.count(b"\n")
+        last = data[-1:]
+    return count + (last != b"\n")
+
+
+def _xy_records(fp, offset, chunk_size=vasp_grid.CHUNK_SIZE):
+    '''"x y" lines (2 numbers) from [offset], until x changes.
+    [output] : [(line index, x), ...] of the first x, and the first line of the next x if there is one'''
+    records, index, pos, size = [], 0, offset, 1 << 16
+    end = os.fstat(fp.fileno()).st_size
+    while pos < end:
+        fp.seek(pos)
+        data = fp.read(size)
+        cut = data.rfind(b"\n") + 1 if pos + size < end else len(data)
+        if cut == 0:
+            size *= 2
+            continue
+        for line in data[:cut].splitlines():
+            tokens = line.split()
+            if len(tokens) == 2:
+                x = float(tokens[0])
+                records.append((index, x))
+                if x != records[0][1]:
+                    return records
+            index += 1
+        pos += cut
+        size = min(size * 2, chunk_size)
+    return records
+
+
+def preflight(filename, chunk_size=vasp_grid.CHUNK_SIZE):
+    '''Layout of CURSAVE from a newline scan of the file (mapped window by window), before any parsing.
+    Only the lines of the first x are split, the rest is counted.
+    [output] : dict of header (0 or 1 skipped line), lines (number of lines after the header, as readlines),
+               grid ((nx, ny, nz) from the "x y" lines, None if the layout is not regular)
+    '''
+    with open(filename, "rb") as fp:
+        header = skip_header(fp)
+        offset = fp.tell()
+        size = os.fstat(fp.fileno()).st_size
+        if size <= offset:
+            return {"header": header, "lines": 0, "grid": None}
+        lines = count_lines(fp, offset, chunk_size)
+        records = _xy_records(fp, offset, chunk_size)
+        fp.seek(max(offset, size - 4096))
+        tail = fp.read()
+    # blank lines at the end are not part of the grid
+    nonblank = lines - max(tail[len(tail.rstrip()):].count(b"\n") - 1, 0)
+
+    grid = None
+    if records and records[0][0] == 0:
+        ny = sum(1 for (i, x) in records if x == records[0][1])
+        if len(records) > 1:
+            nz = records[1][0] - 1
+        else:
+            nz = nonblank - 1
+        spacing = set(j - i for ((i, x), (j, y)) in zip(records, records[1:]))
+        if nz > 0 and spacing <= {nz + 1} and nonblank % (ny * (nz + 1)) == 0:
+            grid = (nonblank // (ny * (nz + 1)), ny, nz)
+    return {"header": header, "lines": lines, "grid": grid}
+
+
+def valid_grid(nlines, nx, ny, nz):
+    '''One "x y" line and nz values per (x, y). Up to 2 extra (blank) lines at the end are allowed.'''
+    t_len = nx * ny * nz + nx * ny
+    return t_len <= nlines <= t_len + 2
+
+
+def read_cursave(filename, nx, ny, nz):
+    '''[output] : xy (nx, ny, 2), current (nx, ny, nz) @np.array(dtype='d'), views of one array'''
+    with open(filename, "rb") as fp:
+        skip_header(fp)
+        data = vasp_grid.read_values(fp, nx * ny * (nz + 2)).reshape(nx, ny, nz + 2)
+    return data[:, :, :2], data[:, :, 2:]
+
+
+def binary_cursave(filename, nx, ny, nz, memory, use_cache=True, max_size=grid_cache.MAX_SIZE):
+    '''CURSAVE as binary array (nx*ny, nz+2) in a .npy file, streamed with [memory] bytes at most.
+    It is kept as sidecar of CURSAVE (grid_cache), and parsed again only if CURSAVE changes.
+    [output] : (path of .npy, True if it is a temporary file to be removed after use)
+    '''
+    shape = (nx * ny, nz + 2)
+    npy = grid_cache.cache_paths(filename, 0, SUFFIX)[0]
+    if use_cache:
+        cached = grid_cache.load(filename, 0, SUFFIX)
+        if cached is not None and cached[1].shape == shape:
+            return npy, False
+
+    key = grid_cache.file_key(filename)
+    tmp = "%s.%d.tmp" % (npy, os.getpid())
+    if not os.access(os.path.dirname(npy), os.W_OK):
+        tmp = os.path.abspath("%s.%d.tmp.npy" % (SUFFIX, os.getpid()))
+    out = np.lib.format.open_memmap(tmp, mode="w+", dtype="d", shape=shape)
+    offset = out.offset
+    del out
+    try:
+        # written with file writes instead of the map, so that written pages do not stay in memory
+        with open(filename, "rb") as fp, open(tmp, "r+b") as out:
+            skip_header(fp)
+            out.seek(offset)
+            # about 3 copies of the text chunk (read, tail + data, cut) and the values parsed from it
+            # are alive at once in iter_values, with the value block : 1/8 of [memory] for each
+            size = max(memory // 8, 1 << 16)
+            for values in vasp_grid.iter_values(fp, shape[0] * shape[1], size // 8, size):
+                out.write(memoryview(values))
+    except BaseException:
+        grid_cache.discard(tmp)
+        raise
+
+    if not use_cache or shape[0] * shape[1] * 8 > max_size:
+        return tmp, True
+    if grid_cache.store(filename, tmp, {"grid": [nx, ny, nz]}, key, max_size, 0, SUFFIX) is None:
+        # the sidecar could not be kept (read-only directory, ...) : the temporary file is used once
+        return tmp, True
+    return npy, False
+
+
+def iter_current_ooc(npy, nx, ny, nz, memory):
+    '''Blocks of z planes of CURRENT (kz, ny, nx) from the binary CURSAVE.
+    For each block, the file is read in tiles of consecutive columns, each mapped only while it is used.
+    Half of [memory] is the block, a quarter is the tile.
+    [output] : generator of (xy (nx*ny, 2) or None after the first block, block). The block buffer is reused.
+    '''
+    offset = np.load(npy, mmap_mode="r").offset
+    kz = min(max(memory // 2 // (nx * ny * 8), 1), nz)
+    tc = min(max(memory // 4 // ((nz + 2) * 8), 1), nx * ny)
+    buf = np.empty((kz, ny * nx), dtype="d")
+    xy = np.empty((nx * ny, 2), dtype="d")
+    column = np.arange(nx * ny)
+    # column (ix, iy) of CURSAVE -> position iy*nx+ix in a plane of CURRENT
+    dest = (column % ny) * nx + column // ny
+    for z0 in range(0, nz, kz):
+        z1 = min(z0 + kz, nz)
+        for c0 in range(0, nx * ny, tc):
+            c1 = min(c0 + tc, nx * ny)
+            tile = np.memmap(npy, dtype="d", mode="r", offset=offset + c0 * (nz + 2) * 8, shape=(c1 - c0, nz + 2))
+            buf[:z1 - z0, dest[c0:c1]] = tile[:, 2 + z0:2 + z1].T
+            if z0 == 0:
+                xy[c0:c1] = tile[:, :2]
+            del tile
+        yield (xy if z0 == 0 else None), buf[:z1 - z0].reshape(-1, ny, nx)
+
+
+def iter_column_tiles(npy, nx, ny, nz, memory):
+    '''Tiles of consecutive columns of the binary CURSAVE, each mapped only while it is used.
+    A quarter of [memory] is the tile.
+    [output] : generator of (c0, xy (ncols, 2), current (ncols, nz)) for columns c0 ~ c0+ncols-1
+    '''
+    offset = np.load(npy, mmap_mode="r").offset
+    tc = min(max(memory // 4 // ((nz + 2) * 8), 1), nx * ny)
+    for c0 in range(0, nx * ny, tc):
+        c1 = min(c0 + tc, nx * ny)
+        tile = np.memmap(npy, dtype="d", mode="r", offset=offset + c0 * (nz + 2) * 8, shape=(c1 - c0, nz + 2))
+        yield c0, tile[:, :2], tile[:, 2:]
+        del tile
+
+
+def convert_ooc(nx, ny, nz, memory, cursave="CURSAVE", current="CURRENT",
+                xy_position="c2c_Real_xy_position.txt", use_cache=True, stm=None):
+    '''CURSAVE -> CURRENT with about [memory] bytes of arrays (see binary_cursave, iter_current_ooc)
+    STM images (stm) are taken from the binary copy, one tile of columns at a time (iter_column_tiles).'''
+    npy, temporary = binary_cursave(cursave, nx, ny, nz, memory, use_cache)
+    try:
+        def planes():
+            for (xy, block) in iter_current_ooc(npy, nx, ny, nz, memory):
+                if xy is not None:
+                    write_xy(xy_position, xy.reshape(nx, ny, 2))
+                yield block
+
+        with open(current, "wb") as out:
+            vasp_grid.write_values(out, planes(), chunk=min(max(memory // 400, 1000), vasp_grid.WRITE_CHUNK))
+        if stm:
+            tiles = iter_column_tiles(npy, nx, ny, nz, memory)
+            stm_image.report(stm_image.tiled_images(tiles, nx, ny, **stm))
+    finally:
+        if temporary:
+            grid_cache.discard(npy)
+
+
+def write_current(filename, current):
+    '''CURRENT in VASP grid order (x fastest, z slowest), 5 values per line.
+    Only one xy plane is transposed (copied) at a time.'''
+    with open(filename, "wb") as out:
+        vasp_grid.write_values(out, (current[:, :, iz].T for iz in range(current.shape[2])))
+
+
+def write_xy(filename, xy):
+    '''Real-space (x, y) of every column, x fastest'''
+    xy = xy.transpose(1, 0, 2).reshape(-1, 2)
+    with open(filename, "w") as f:
+        f.write(igor_itx.format_rows([xy[:, 0], xy[:, 1]], fmt="%f", sep="   "))
+
+
+def convert(nx=None, ny=None, nz=None, cursave="CURSAVE", current="CURRENT", report="c2c_CAL_REPORT.txt",
+            xy_position="c2c_Real_xy_position.txt", memory=None, use_cache=True, stm=None):
+    '''CURSAVE -> CURRENT, with the validation report and the (x, y) positions.
+    nx, ny, nz : None = grid of the pre-flight (see preflight)
+    memory : None = whole grid in memory, otherwise out-of-core conversion with about [memory] bytes
+    stm : keyword arguments of stm_image.images (heights, isos, fmt, outdir, workers). Images from the same read.
+    [output] : (nx, ny, nz) if it agrees with CURSAVE, None if not'''
+    chunk_size = vasp_grid.CHUNK_SIZE if memory is None else min(max(memory // 4, 1 << 16), vasp_grid.CHUNK_SIZE)
+    info = preflight(cursave, chunk_size)
+    guess = info["grid"]
+    with open(report, "w") as resu:
+        if nx is None:
+            if guess is None:
+                print("[error] grid point numbers could not be found from %s. Give X Y Z." % cursave, file=resu)
+                return None
+            (nx, ny, nz) = guess
+        if not valid_grid(info["lines"], nx, ny, nz) or (guess is not None and guess != (nx, ny, nz)):
+            print("[error] (%s,%s,%s) is wrong grid point numbers." % (nx, ny, nz), file=resu)
+            if guess is not None:
+                print("[hint] %s looks like (%d,%d,%d)." % ((cursave,) + guess), file=resu)
+            return None
+        print("[good] (%s,%s,%s) is valid grid point numbers." % (nx, ny, nz), file=resu)
+    if memory is not None:
+        convert_ooc(nx, ny, nz, memory, cursave, current, xy_position, use_cache, stm)
+        return (nx, ny, nz)
+    xy, values = read_cursave(cursave, nx, ny, nz)
+    write_xy(xy_position, xy)
+    write_current(current, values)
+    if stm:
+        stm_image.report(stm_image.images(xy, values, **stm))
+    return (nx, ny, nz)
+
+
+def write_time(filename, seconds):
+    with open(filename, 'w') as TiMe:
+        print("---%s seconds ---" % seconds, file=TiMe)
+
+
+def batch_job(path, options):
+    '''One CURSAVE (or directory with CURSAVE) of batch mode. Every output is written in its directory.
+    [output] : (directory, grid or None, seconds, error message or None)'''
+    if os.path.isdir(path):
+        dirname, cursave = path, os.path.join(path, "CURSAVE")
     else:
-        fft_max = int(fft_total / 5) * 5
-        fft_remain = fft_total - fft_max
-        for i in range(0, fft_max, 5):
-            print( str(ftr_split[i])+"   "+str(ftr_split[i+1])+"   "+str(ftr_split[i+2])+"   "+str(ftr_split[i+3])+"   "+str(ftr_split[i+4])+"   ",file=save)
-        print ('   '.join([str(ftr_split[j]) for j in range(fft_total-fft_remain, fft_total)]),file=save)
-    save.close()    
-    ftr.close()
+        dirname, cursave = os.path.dirname(path) or ".", path
+    s_t = time.time()
+    if not os.path.isfile(cursave):
+        return dirname, None, 0.0, "%s doesn't exist" % cursave
+    report = os.path.join(dirname, "c2c_CAL_REPORT.txt")
+    stm = dict(options["stm"], outdir=dirname, workers=1) if options.get("stm") else None
+    try:
+        grid = convert(*options["grid"], cursave=cursave, current=os.path.join(dirname, "CURRENT"), report=report,
+                       xy_position=os.path.join(dirname, "c2c_Real_xy_position.txt"),
+                       memory=options["memory"], use_cache=options["use_cache"], stm=stm)
+    except Exception:
+        return dirname, None, time.time() - s_t, traceback.format_exc().strip().splitlines()[-1]
+    seconds = time.time() - s_t
+    write_time(os.path.join(dirname, "c2c_Time.txt"), seconds)
+    if grid is None:
+        with open(report) as resu:
+            return dirname, None, seconds, " ".join(resu.read().split("\n")).strip()
+    return dirname, grid, seconds, None
+
+
+def _collect(paths, options, workers, jobs, index=None):
+    '''Run batch_job of paths in a pool of [workers] processes, one future per path, and store the results in jobs[index[i]].
+    [output] : list of index of the paths whose worker died (BrokenProcessPool), they are stored as failed'''
+    index = list(range(len(paths))) if index is None else index
+    broken = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(batch_job, path, options): i for (i, path) in zip(index, paths)}
+        for future in as_completed(futures):
+            i = futures[future]
+            path = paths[index.index(i)]
+            dirname = path if os.path.isdir(path) else (os.path.dirname(path) or ".")
+            try:
+                jobs[i] = future.result()
+            except BrokenProcessPool:
+                broken.append(i)
+                jobs[i] = (dirname, None, 0.0, "worker process died (killed or out of memory)")
+            except Exception as error:
+                jobs[i] = (dirname, None, 0.0, "%s: %s" % (type(error).__name__, error))
+    return sorted(broken)
+
+
+def run_batch(paths, options, workers=None, summary="c2c_summary.txt"):
+    '''Convert every CURSAVE (or directory) of paths (globs are expanded) with [workers] processes (default=number of cores).
+    A failed one is reported in the summary, and the others go on.
+    [output] : list of (directory, grid, seconds, error) in the order of the paths'''
+    s_t = time.time()
+    paths = [p for pattern in paths for p in (sorted(glob.glob(pattern)) or [pattern])]
+    workers = min(workers or os.cpu_count() or 1, len(paths))
+    print("--------------        Batch mode : %d CURSAVE(s), %d worker(s)        --------------" % (len(paths), workers))
+    if workers == 1:
+        jobs = [batch_job(path, options) for path in paths]
+    else:
+        jobs = [None] * len(paths)
+        broken = _collect(paths, options, workers, jobs)
+        # when a worker dies (killed, out of memory, ...) the pool fails every unfinished CURSAVE,
+        # so each of them is converted again alone : only the one which kills its worker again fails
+        for i in broken:
+            _collect([paths[i]], options, 1, jobs, [i])
+
+    nfail = 0
+    with open(summary, 'w') as out:
+        print("# %-38s %16s %10s  %s" % ("directory", "grid", "time(s)", "status"), file=out)
+        for (dirname, grid, seconds, error) in jobs:
+            if error is not None:
+                nfail += 1
+                print("  %-38s %16s %10.2f  FAILED: %s" % (dirname, "-", seconds, error), file=out)
+            else:
+                print("  %-38s %16s %10.2f  ok" % (dirname, "%dx%dx%d" % grid, seconds), file=out)
+        print("# total %.2f seconds (sum of jobs %.2f seconds), %d worker(s)" % (time.time() - s_t, sum(j[2] for j in jobs), workers), file=out)
+    print("--------------   %d done, %d failed. Summary is written in [ %s ]   --------------" % (len(jobs) - nfail, nfail, summary))
+    return jobs
+
+
+def main():
+    s_t = time.time()
+    pars = argparse.ArgumentParser()
+    pars.add_argument('grid', type=int, nargs='*', metavar='X Y Z', help='x, y, z grids. default: found from CURSAVE')
+    pars.add_argument('-m', '--memory', type=float, default=None,
+                      help='Out-of-core conversion with about this memory (MB) for arrays. default: whole grid in memory')
+    pars.add_argument('--nocache', action='store_true', help='Do not keep the binary copy of CURSAVE (out-of-core)')
+    pars.add_argument('--height', type=float, nargs='+', default=[], help='Constant-height STM images at these heights (grid index)')
+    pars.add_argument('--iso', type=float, nargs='+', default=[], help='Constant-current STM images at these currents')
+    pars.add_argument('-f', type=str, default="png", choices=stm_image.FORMATS, help='Format of STM images. default=png')
+    pars.add_argument('-j', type=int, default=None,
+                      help='Number of worker processes (STM images, or CURSAVEs of batch mode). default=1, number of cores for batch')
+    pars.add_argument('--batch', type=str, nargs='+', default=None,
+                      help="CURSAVE files or directories (or globs, e.g. 'bias_*'). Each one is converted in its directory. X Y Z go before --batch")
+    pars.add_argument('--summary', type=str, default="c2c_summary.txt", help='Summary of batch mode. default=c2c_summary.txt')
+    args = pars.parse_args()
 
-else:
-    print("[error] (%s,%s,%s) is wrong grid point numbers."%(nx,ny,nz), file=resu)
-    CUR.close()
-resu.close()
+    if len(args.grid) not in (0, 3):
+        pars.error("give X Y Z, or nothing to find them from CURSAVE")
+    memory = None if args.memory is None else int(args.memory * 1024**2)
+    stm = None
+    if args.height or args.iso:
+        stm = {"heights": args.height, "isos": args.iso, "fmt": args.f, "workers": args.j or 1}
+    if args.batch is not None:
+        options = {"grid": args.grid or [None] * 3, "memory": memory, "use_cache": not args.nocache, "stm": stm}
+        run_batch(args.batch, options, args.j, args.summary)
+        return
+    grid = convert(*(args.grid or [None] * 3), memory=memory, use_cache=not args.nocache, stm=stm)
+    if grid is None:
+        with open("c2c_CAL_REPORT.txt") as resu:
+            print(resu.read().rstrip())
+    elif not args.grid:
+        print("grid point numbers from CURSAVE : (%d,%d,%d)" % grid)
 
+    write_time('c2c_Time.txt', time.time() - s_t)
 
-              
-TiMe=open('c2c_Time.txt','w')
-print("---%s seconds ---"%(time.time()-s_t),file=TiMe)
-TiMe.close()
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+import sys
+import json
+import zlib
+import struct
+import argparse
+import numpy as np
+
+##########################################################################
+## Compressed binary container for volumetric grids (.vgrid)           ##
+## [MAGIC] [tile 0] [tile 1] ... [JSON index] [index length] [MAGIC]    ##
+## The grid (nz, ny, nx) is cut into tiles of TILE=(tz, ty, tx) points. ##
+## Each tile is byte-shuffled and zlib-compressed on its own, so one    ##
+## plane or sub-box is read by decompressing only the tiles it touches. ##
+##########################################################################
+
+MAGIC = b"VGRID001"
+TILE = (16, 64, 64)
+
+
+def _shuffle(a):
+    # bytes of the same significance next to each other : compresses much better for floats
+    return np.ascontiguousarray(a.reshape(-1).view(np.uint8).reshape(-1, 8).T).tobytes()
+
+
+def _unshuffle(raw, shape):
+    return np.frombuffer(raw, dtype=np.uint8).reshape(8, -1).T.copy().view("<f8").reshape(shape)
+
+
+def _jsonable(header):
+    return dict(header, cell_vec=np.asarray(header["cell_vec"]).tolist(), coord=np.asarray(header["coord"]).tolist())
+
+
+def write_archive(filename, header, blocks, tile=TILE, level=3):
+    '''Write a grid as tiled compressed archive, while the values are coming.
+    [input] : filename, header (see vasp_grid.read_header), blocks (iterable of arrays, x fastest and z slowest, any size),
+              tile : (tz, ty, tx), level : zlib compression level
+    Only tz xy-planes are kept in memory.
+    '''
+    nx, ny, nz = header["grid"]
+    tz, ty, tx = [int(t) for t in tile]
+    slab = np.empty(tz * ny * nx, dtype="<f8")
+    index, filled, z0 = [], 0, 0
+    with open(filename, "wb") as out:
+        out.write(MAGIC)
+
+        def flush(nplanes):
+            part = slab[:nplanes * ny * nx].reshape(nplanes, ny, nx)
+            for y0 in range(0, ny, ty):
+                for x0 in range(0, nx, tx):
+                    raw = zlib.compress(_shuffle(part[:, y0:y0 + ty, x0:x0 + tx]), level)
+                    index.append([out.tell(), len(raw)])
+                    out.write(raw)
+
+        for values in blocks:
+            values = np.asarray(values).reshape(-1)
+            pos = 0
+            while pos < values.size:
+                n = min(slab.size - filled, values.size - pos)
+                slab[filled:filled + n] = values[pos:pos + n]
+                filled, pos = filled + n, pos + n
+                if filled == slab.size:
+                    flush(tz)
+                    filled, z0 = 0, z0 + tz
+        if filled:
+            flush(filled // (ny * nx))
+            z0 += filled // (ny * nx)
+        if z0 != nz or filled % (ny * nx):
+            raise IOError("------- %d values were written for a %d x %d x %d grid. -------" % (z0 * ny * nx + filled % (ny * nx), nx, ny, nz))
+
+        info = json.dumps({"header": _jsonable(header), "grid": [nx, ny, nz], "tile": [tz, ty, tx],
+                           "dtype": "<f8", "codec": "zlib+shuffle", "tiles": index}).encode()
+        out.write(info)
+        out.write(struct.pack("<Q", len(info)))
+        out.write(MAGIC)
+
+
+def read_archive_header(filename):
+    '''[output] : info @dict with header, grid, tile and the tile index'''
+    with open(filename, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise IOError("------- %s is not a grid archive. -------" % filename)
+        f.seek(-8 - len(MAGIC), 2)
+        length = struct.unpack("<Q", f.read(8))[0]
+        f.seek(-8 - len(MAGIC) - length, 2)
+        info = json.loads(f.read(length).decode())
+    info["header"]["cell_vec"] = np.array(info["header"]["cell_vec"], dtype="d")
+    info["header"]["coord"] = np.array(info["header"]["coord"], dtype="d").reshape(-1, 3)
+    return info
+
+
+def _range(r, n):
+    if r is None:
+        return 0, n
+    start, stop = r
+    return max(start, 0), min(stop, n)
+
+
+def read_box(filename, z=None, y=None, x=None, info=None):
+    '''Read the sub-box [z0:z1, y0:y1, x0:x1] of an archive.
+    [input] : filename, z=(z0, z1), y=(y0, y1), x=(x0, x1). None means the whole axis.
+              info : result of read_archive_header, to avoid reading it again.
+    [output] : np.array(dtype='d') with shape (z1-z0, y1-y0, x1-x0)
+    '''
+    if info is None:
+        info = read_archive_header(filename)
+    nx, ny, nz = info["grid"]
+    tz, ty, tx = info["tile"]
+    (z0, z1), (y0, y1), (x0, x1) = _range(z, nz), _range(y, ny), _range(x, nx)
+    out = np.empty((max(z1 - z0, 0), max(y1 - y0, 0), max(x1 - x0, 0)), dtype="d")
+    nty, ntx = -(-ny // ty), -(-nx // tx)
+    with open(filename, "rb") as f:
+        for kz in range(z0 // tz, -(-z1 // tz)):
+            for ky in range(y0 // ty, -(-y1 // ty)):
+                for kx in range(x0 // tx, -(-x1 // tx)):
+                    offset, length = info["tiles"][(kz * nty + ky) * ntx + kx]
+                    f.seek(offset)
+                    zs, ys, xs = kz * tz, ky * ty, kx * tx
+                    shape = (min(tz, nz - zs), min(ty, ny - ys), min(tx, nx - xs))
+                    t = _unshuffle(zlib.decompress(f.read(length)), shape)
+                    a, b, c = max(z0, zs), max(y0, ys), max(x0, xs)
+                    d, e, g = min(z1, zs + shape[0]), min(y1, ys + shape[1]), min(x1, xs + shape[2])
+                    out[a - z0:d - z0, b - y0:e - y0, c - x0:g - x0] = t[a - zs:d - zs, b - ys:e - ys, c - xs:g - xs]
+    return out
+
+
+def read_plane(filename, direction, index, info=None):
+    '''One grid plane perpendicular to direction (a/b/c or x/y/z or 1/2/3) at grid index [index].
+    [output] : np.array(dtype='d'). c : (ny, nx), b : (nz, nx), a : (nz, ny)
+    '''
+    if direction in "cCzZ3":
+        return read_box(filename, z=(index, index + 1), info=info)[0]
+    elif direction in "bByY2":
+        return read_box(filename, y=(index, index + 1), info=info)[:, 0, :]
+    elif direction in "aAxX1":
+        return read_box(filename, x=(index, index + 1), info=info)[:, :, 0]
+    raise IOError("------- Wrong input of direction. -------")
+
+
+def read_archive(filename):
+    '''[output] : header, whole grid @np.array(dtype='d') with shape (nz, ny, nx)'''
+    info = read_archive_header(filename)
+    return info["header"], read_box(filename, info=info)
+
+
+def main():
+    pars = argparse.ArgumentParser(description="Show or extract a grid archive (.vgrid) written by ws_chg.py")
+    pars.add_argument("archive", type=str)
+    pars.add_argument("-d", type=str, default=None, help="Direction of the plane to extract (a/b/c or x/y/z or 1/2/3)")
+    pars.add_argument("-n", type=int, default=0, help="Grid index of the plane to extract")
+    pars.add_argument("-o", type=str, default=None, help="Output file. With -d : plane as text, otherwise the whole grid in VASP format")
+    args = pars.parse_args()
+
+    info = read_archive_header(args.archive)
+    nx, ny, nz = info["grid"]
+    print("* Name of System : %s" % info["header"]["name"])
+    print("* Matrix : [ %d ] x [ %d ] x [ %d ], tile : %s, %d tiles" % (nx, ny, nz, info["tile"], len(info["tiles"])))
+    if args.d is not None:
+        plane = read_plane(args.archive, args.d, args.n, info)
+        np.savetxt(args.o or sys.stdout, plane)
+    elif args.o is not None:
+        import vasp_grid
+        with open(args.o, "wb") as out:
+            out.write(vasp_grid.format_header(info["header"]))
+            tz = info["tile"][0]
+            vasp_grid.write_values(out, (read_box(args.archive, z=(kz, kz + tz), info=info) for kz in range(0, nz, tz)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+import os
+import json
+import time
+import contextlib
+import numpy as np
+import vasp_grid
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+##########################################################################
+## Binary sidecar cache for parsed volumetric files.                    ##
+## LOCPOT -> .LOCPOT.gridcache.npy (grid) + .LOCPOT.gridcache.json      ##
+## The sidecar is valid while path, size and mtime of LOCPOT are same.  ##
+## Every sidecar is listed in REGISTRY, to evict old ones by total size.##
+## Every read-modify-write of REGISTRY holds a lock (flock) on          ##
+## REGISTRY.lock, so that parallel jobs do not lose entries.            ##
+##########################################################################
+
+REGISTRY = os.path.join(os.path.expanduser("~"), ".cache", "vasp_grid", "registry.json")
+MAX_SIZE = 20 * 1024**3
+
+
+def cache_paths(filename, block=0, suffix="gridcache"):
+    '''[output] : (path of grid sidecar (.npy), path of header sidecar (.json)) of grid [block]
+    suffix : kind of sidecar. "gridcache" is the parsed grid, other modules keep their own arrays (e.g. grid_sat).'''
+    dirname, basename = os.path.split(os.path.abspath(filename))
+    stem = os.path.join(dirname, ".%s.%s" % (basename, suffix))
+    if block:
+        stem += ".b%d" % block
+    return stem + ".npy", stem + ".json"
+
+
+def file_key(filename):
+    st = os.stat(filename)
+    return {"path": os.path.abspath(filename), "size": st.st_size, "mtime": st.st_mtime_ns}
+
+
+@contextlib.contextmanager
+def _locked():
+    '''Exclusive lock of REGISTRY, held until the end of the with block.
+    Without fcntl, or if the lock file cannot be made (read-only home, ...), nothing is locked.'''
+    lock = None
+    if fcntl is not None:
+        try:
+            os.makedirs(os.path.dirname(REGISTRY), exist_ok=True)
+            lock = open(REGISTRY + ".lock", "a")
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        except OSError:
+            if lock is not None:
+                lock.close()
+            lock = None
+    try:
+        yield
+    finally:
+        if lock is not None:
+            lock.close()
+
+
+def _read_registry():
+    try:
+        with open(REGISTRY) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_registry(registry):
+    '''Call only with _locked() held'''
+    os.makedirs(os.path.dirname(REGISTRY), exist_ok=True)
+    tmp = "%s.%d.tmp" % (REGISTRY, os.getpid())
+    with open(tmp, "w") as f:
+        json.dump(registry, f)
+    os.replace(tmp, REGISTRY)
+
+
+def discard(npy):
+    '''Remove a sidecar (or a temporary .npy file) and its header (.json) if they exist.'''
+    for path in (npy, npy[:-4] + ".json"):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _evict(registry, max_size):
+    '''Remove least recently used sidecars of registry until their total size is below max_size, and write it.
+    Call only with _locked() held.'''
+    registry = {k: v for (k, v) in registry.items() if os.path.exists(k)}
+    total = sum(v["size"] for v in registry.values())
+    for npy in sorted(registry, key=lambda k: registry[k]["atime"]):
+        if total <= max_size:
+            break
+        discard(npy)
+        total -= registry.pop(npy)["size"]
+    try:
+        _write_registry(registry)
+    except OSError:
+        pass
+
+
+def evict(max_size=MAX_SIZE):
+    '''Remove least recently used sidecars until their total size is below max_size (bytes).'''
+    with _locked():
+        _evict(_read_registry(), max_size)
+
+
+def clear_cache():
+    '''Remove every registered sidecar.'''
+    with _locked():
+        for npy in _read_registry():
+            discard(npy)
+        try:
+            _write_registry({})
+        except OSError:
+            pass
+
+
+def load(filename, block=0, suffix="gridcache"):
+    '''[output] : (header, grid) from the sidecar of filename, or None if there is no valid sidecar.
+    The grid is memory-mapped copy-on-write : it can be modified in memory, the sidecar is never changed.'''
+    npy, meta = cache_paths(filename, block, suffix)
+    try:
+        with open(meta) as f:
+            info = json.load(f)
+        if info["key"] != file_key(filename):
+            return None
+        data = np.load(npy, mmap_mode="c")
+    except (OSError, ValueError, KeyError):
+        return None
+    header = info["header"]
+    if "cell_vec" in header:
+        header["cell_vec"] = np.array(header["cell_vec"], dtype="d")
+    if "coord" in header:
+        header["coord"] = np.array(header["coord"], dtype="d").reshape(-1, 3)
+
+    with _locked():
+        registry = _read_registry()
+        if npy in registry:
+            registry[npy]["atime"] = time.time()
+            try:
+                _write_registry(registry)
+            except OSError:
+                pass
+    return header, data
+
+
+def store(filename, tmp, header=None, key=None, max_size=MAX_SIZE, block=0, suffix="gridcache"):
+    '''Keep the finished .npy file [tmp] as the sidecar of filename (moved), with its header, and register it.
+    [input] : filename, tmp (path of .npy file), header (dict, arrays are allowed. None = no header),
+              key (file_key of filename taken before it was read. None = now), max_size, block, suffix (see cache_paths)
+    [output] : path of the sidecar, or None if it could not be kept (tmp is left as it is, see discard)
+    '''
+    if key is None:
+        key = file_key(filename)
+    npy, meta = cache_paths(filename, block, suffix)
+    header = dict((k, v.tolist() if isinstance(v, np.ndarray) else v) for (k, v) in (header or {}).items())
+    try:
+        os.replace(tmp, npy)
+    except OSError:
+        return None
+    try:
+        with open(meta, "w") as f:
+            json.dump({"key": key, "header": header}, f)
+    except OSError:
+        try:
+            os.replace(npy, tmp)
+        except OSError:
+            discard(npy)
+        return None
+    with _locked():
+        registry = _read_registry()
+        registry[npy] = {"size": os.path.getsize(npy), "atime": time.time()}
+        _evict(registry, max_size)
+    return npy
+
+
+def save(filename, header, data, key=None, max_size=MAX_SIZE, block=0, suffix="gridcache"):
+    '''Write the sidecar of filename. Nothing is done if it cannot be written (read-only directory, ...).'''
+    if data.nbytes > max_size:
+        return
+    if key is None:
+        key = file_key(filename)
+    tmp = "%s.%d.tmp" % (cache_paths(filename, block, suffix)[0], os.getpid())
+    try:
+        with open(tmp, "wb") as f:
+            np.save(f, data)
+    except OSError:
+        discard(tmp)
+        return
+    if store(filename, tmp, header, key, max_size, block, suffix) is None:
+        discard(tmp)
+
+
+def read_grid(filename, use_cache=True, max_size=MAX_SIZE, block=0, workers=1):
+    '''Same as vasp_grid.read_grid, but the parsed grid is taken from / stored to the sidecar cache.'''
+    if not use_cache:
+        return vasp_grid.read_grid(filename, block, workers)
+    cached = load(filename, block)
+    if cached is not None:
+        return cached
+    key = file_key(filename)
+    header, data = vasp_grid.read_grid(filename, block, workers)
+    save(filename, header, data, key, max_size, block)
+    return header, data
+
+
+def read_planar_averages(filename, use_cache=True, max_size=MAX_SIZE, block=0):
+    '''Planar averages along a, b and c without holding the grid in memory.
+    The grid is read one xy plane at a time (from the sidecar if it is valid).
+    Otherwise the text file is streamed, and the planes are written to a new sidecar on the way.
+    [output] : header, [avg_a, avg_b, avg_c]
+    '''
+    cached = load(filename, block) if use_cache else None
+    if cached is not None:
+        header, data = cached
+        nx, ny, nz = header["grid"]
+        return header, vasp_grid.planar_averages(_read_blocks(data, nx * ny), header["grid"])
+
+    key = file_key(filename)
+    with open(filename, "rb") as fp:
+        header = vasp_grid.seek_grid(fp, block)
+        nx, ny, nz = header["grid"]
+        slabs = vasp_grid.iter_values(fp, nx * ny * nz, nx * ny)
+        if not use_cache or nx * ny * nz * 8 > max_size:
+            return header, vasp_grid.planar_averages(slabs, header["grid"])
+
+        tmp = "%s.%d.tmp" % (cache_paths(filename, block)[0], os.getpid())
+        try:
+            out = open(tmp, "wb")
+        except OSError:
+            return header, vasp_grid.planar_averages(slabs, header["grid"])
+
+        # Planes are written with file writes, not through a map of the sidecar :
+        # dirty pages of a map stay in memory, and the memory would grow with the grid.
+        def write_through(slabs):
+            for slab in slabs:
+                out.write(memoryview(slab))
+                yield slab
+
+        try:
+            with out:
+                np.lib.format.write_array_header_1_0(out, {"descr": np.lib.format.dtype_to_descr(np.dtype("d")), "fortran_order": False, "shape": (nz, ny, nx)})
+                avgs = vasp_grid.planar_averages(write_through(slabs), header["grid"])
+        except BaseException:
+            discard(tmp)
+            raise
+    if store(filename, tmp, header, key, max_size, block) is None:
+        discard(tmp)
+    return header, avgs
+
+
+def _read_blocks(data, size):
+    '''Consecutive blocks of [size] values of a loaded sidecar, read with plain reads into one reused buffer.
+    Slicing the map instead would keep every page read so far in memory.
+    [input] : data (memory-mapped array of load), size
+    [output] : generator of np.array(dtype='d') (buffer is reused, see vasp_grid.iter_values)
+    '''
+    npy, offset, total = data.filename, data.offset, data.size
+    del data
+    buf = np.empty(max(min(size, total), 1), dtype="d")
+    with open(npy, "rb") as f:
+        f.seek(offset)
+        for i in range(0, total, size):
+            view = buf[:min(size, total - i)]
+            if f.readinto(memoryview(view).cast("B")) != view.nbytes:
+                raise IOError("------- %s is shorter than its header. -------" % npy)
+            yield view
+
+
+def iter_grid(filename, size, use_cache=True, block=0, chunk_size=vasp_grid.CHUNK_SIZE):
+    '''Read one grid as consecutive blocks of [size] values (x fastest, z slowest).
+    Blocks are read from the sidecar if it is valid (see _read_blocks), otherwise parsed from the text file
+    with chunk_size bytes of text at a time. Nothing is written to the cache.
+    [output] : header, generator of np.array(dtype='d') (buffer is reused, see vasp_grid.iter_values)
+    '''
+    cached = load(filename, block) if use_cache else None
+    if cached is not None:
+        header, data = cached
+        return header, _read_blocks(data, size)
+
+    fp = open(filename, "rb")
+    try:
+        header = vasp_grid.seek_grid(fp, block)
+    except BaseException:
+        fp.close()
+        raise
+    nx, ny, nz = header["grid"]
+
+    def blocks():
+        with fp:
+            for values in vasp_grid.iter_values(fp, nx * ny * nz, size, chunk_size):
+                yield values
+    return header, blocks()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+import os
+import numpy as np
+import vasp_grid
+import grid_cache
+
+##########################################################################
+## Summed-area tables of xy planes, for averages over in-plane regions. ##
+## table[z, j, i] = sum of grid[z, :j, :i], shape (nz, ny+1, nx+1).    ##
+## Sum over any rectangle of a plane = 4 lookups, so the average over   ##
+## a window along z (or over many windows) never rescans the grid.      ##
+## The table is kept as sidecar of the grid file (.gridsat.npy).        ##
+##########################################################################
+
+SUFFIX = "gridsat"
+
+
+def build_table(planes, grid, out=None):
+    '''Summed-area table of every xy plane.
+    [input] : planes (grid (nz, ny, nx) or iterable of xy planes, x fastest), grid [nx, ny, nz],
+              out : array (nz, ny+1, nx+1) to be filled (e.g. memory-mapped file). New array if None.
+    [output] : table @np.array(dtype='d') with shape (nz, ny+1, nx+1)
+    '''
+    nx, ny, nz = grid
+    if out is None:
+        out = np.empty((nz, ny + 1, nx + 1), dtype="d")
+    out[:, 0, :] = 0
+    out[:, :, 0] = 0
+    k = -1
+    for (k, plane) in enumerate(planes):
+        t = out[k, 1:, 1:]
+        np.cumsum(np.asarray(plane).reshape(ny, nx), axis=0, out=t)
+        np.cumsum(t, axis=1, out=t)
+    if k != nz - 1:
+        raise IOError("------- %d planes were given for a grid with nz = %d. -------" % (k + 1, nz))
+    return out
+
+
+def _plane_size(filename, block=0):
+    '''[output] : number of values of one xy plane of grid [block]'''
+    with open(filename, "rb") as fp:
+        nx, ny, nz = vasp_grid.seek_grid(fp, block)["grid"]
+    return nx * ny
+
+
+def read_table(filename, use_cache=True, max_size=grid_cache.MAX_SIZE, block=0):
+    '''Summed-area table of grid [block] of filename, from the sidecar if it is valid.
+    Otherwise it is built plane by plane (from the grid sidecar or the text file) and stored.
+    [output] : header, table (see build_table)
+    '''
+    if use_cache:
+        cached = grid_cache.load(filename, block, SUFFIX)
+        if cached is not None:
+            return cached
+    key = grid_cache.file_key(filename)
+    header, planes = grid_cache.iter_grid(filename, _plane_size(filename, block), use_cache, block)
+    nx, ny, nz = header["grid"]
+    size = nz * (ny + 1) * (nx + 1) * 8
+    if not use_cache or size > max_size:
+        return header, build_table(planes, header["grid"])
+
+    tmp = "%s.%d.tmp" % (grid_cache.cache_paths(filename, block, SUFFIX)[0], os.getpid())
+    try:
+        out = np.lib.format.open_memmap(tmp, mode="w+", dtype="d", shape=(nz, ny + 1, nx + 1))
+    except OSError:
+        return header, build_table(planes, header["grid"])
+    try:
+        build_table(planes, header["grid"], out)
+        out.flush()
+    except BaseException:
+        del out
+        grid_cache.discard(tmp)
+        raise
+    del out
+    if grid_cache.store(filename, tmp, header, key, max_size, block, SUFFIX) is None:
+        grid_cache.discard(tmp)
+    cached = grid_cache.load(filename, block, SUFFIX)
+    if cached is None:
+        # the sidecar could not be kept (read-only directory, ...)
+        return read_table(filename, False, max_size, block)
+    return cached
+
+
+def _prefix(table, j, i):
+    '''Sum of the periodic grid over [0:j, 0:i] of every plane, j and i can be up to 2*ny, 2*nx (wrap-around).
+    [output] : array (nz, ...) for index arrays j, i'''
+    ny, nx = table.shape[1] - 1, table.shape[2] - 1
+    qj, rj = np.divmod(j, ny)
+    qi, ri = np.divmod(i, nx)
+    return (table[:, rj, ri] + qi * table[:, rj, nx] + qj * table[:, ny, ri] + qi * qj * table[:, ny, nx, None])
+
+
+def window_index(table, x, y):
+    '''Grid window of fractional in-plane coordinates.
+    [input] : x=(x0, x1), y=(y0, y1) in fractional coordinates (x1 < x0 means the window crosses the cell boundary)
+    [output] : (j0, j1, i0, i1), half-open grid range with 0 <= j0 < ny, j0 < j1 <= j0+ny (same for i)
+    '''
+    ny, nx = table.shape[1] - 1, table.shape[2] - 1
+    out = []
+    for ((a0, a1), n) in ((y, ny), (x, nx)):
+        i0 = int(round(a0 * n)) % n
+        width = n if abs(a1 - a0) >= 1 else int(round(((a1 - a0) % 1) * n))
+        out += [i0, i0 + min(max(width, 1), n)]
+    return tuple(out)
+
+
+def region_profiles(table, windows):
+    '''Average over in-plane windows along z. O(1) per window and z.
+    [input] : table (see build_table), windows : array (m, 4) of grid ranges (j0, j1, i0, i1) (see window_index)
+    [output] : np.array(dtype='d') with shape (m, nz)
+    '''
+    w = np.asarray(windows, dtype=int).reshape(-1, 4)
+    j0, j1, i0, i1 = w.T
+    total = _prefix(table, j1, i1) - _prefix(table, j0, i1) - _prefix(table, j1, i0) + _prefix(table, j0, i0)
+    return (total / ((j1 - j0) * (i1 - i0))).T
+
+
+def region_profile(table, x=(0, 1), y=(0, 1)):
+    '''Average over one in-plane window (fractional coordinates) along z.
+    [output] : np.array(dtype='d') with shape (nz,)'''
+    return region_profiles(table, [window_index(table, x, y)])[0]
@@ -2,7 +2,17 @@
 import numpy as np
 import argparse
 import os
-import sys
+import glob
+import traceback
+import io
+import collections
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import grid_cache
+import vasp_out
+import grid_sat
+import igor_itx
+import gyp_plot
 
 ##########################################################################
 ## -----------------------------About code----------------------------- ##
@@ -18,126 +28,73 @@ import sys
 ## If you use this code in server (which is not local), 'plt.show()' command will not work if you don't use 'Xwindows' in Server.                ##
 ## $ ssh -X [user@server] --> connect server through this command will help you.                                                                 ##
 ## And you must set 'XForwarding yes' in your local terminal. You might can find in '/etc/ssh/sshd_config' file.                                 ##
-## If troubles using $DISPLAY keep happens, tag out all parts of Visualization (2), which is matplotlib part. It will solve that problem.        ##
+## If troubles using $DISPLAY keep happens, do not use -v. Images are drawn with non-interactive backend (see gyp_plot.py).                      ##
 ## --------------------------------------------------------------------------------------------------------------------------------------------- ##
 ###################################################################################################################################################
 
 
-pars = argparse.ArgumentParser()
-pars.add_argument('-i',type=str,default='LOCPOT',help="* Name of input file. default=LOCPOT")
-pars.add_argument('-o', type=str,default='output.dat',help="* Name of output file (data file). If fermi value is existed (both manually input or extracted), it automatically shift the value.")
-pars.add_argument("-fermi", help="* Set fermi level Manually", type=float, default=0)
-pars.add_argument('-v', help="* If you want to see the plot, turn this on", action='store_true')
-pars.add_argument('-igor',help='* If you want to get .itx file(Igor format), turn this on', action="store_true")
-pars.add_argument('-igor_o',type=str,default='Potential',help="* Name of Igor output file")
-pars.add_argument('-d',type=str,default='z',help="Wanted direction. You can set a/b/c or x/y/z or 1/2/3 for the direction.")
-pars.add_argument('--vac_Ediff', default=1E-3, type=float, help="Vacuum region convergence Ediff")
-pars.add_argument('--vac_width', default=3.0, type=float, help="Vacuum region convergence width. Unit is angstrom")
-args = pars.parse_args()
-input_file, fermi_e, output_file, visualization, igor, igor_output,direction=args.i, args.fermi, args.o, args.v, args.igor, args.igor_o, args.d
-vac_con_Ediff, vac_con_width = args.vac_Ediff, args.vac_width
-
 def mkdir(dirname):
     if not os.path.exists(os.path.dirname(dirname+"/")):
         os.makedirs(os.path.dirname(dirname+"/"))
 
 
-def read_CHGCAR(ipf="LOCPOT",direction="Z"):
-    ip=open(ipf,'r')
-    print ('* Name of System : ' + ip.readline())
-    ip.readline()
-    cell_vec=[]
-    cell_vec.append(ip.readline().split())
-    cell_vec.append(ip.readline().split())
-    cell_vec.append(ip.readline().split())
-    cell_vec=np.array(cell_vec,dtype="d")
-    species=ip.readline().split()
-    natoms=list(map(lambda x:int(x),ip.readline().split()))
-    tot_natoms=sum(natoms)
-    coord_read=ip.readline()
-    if coord_read.startswith("D") or coord_read.startswith("d"):
-        coord_type="Direct"
-    elif coord_read.startswith("F") or coord_read.startswith("f"):
-        coord_type="Direct"
-    elif coord_read.startswith("C") or coord_read.startswith("c"):
-        coord_type="Cartesian"
+def read_CHGCAR(ipf="LOCPOT",direction="Z",use_cache=True,cache_max=grid_cache.MAX_SIZE,stream=False,block=0,nproc=1,verbose=True):
+    if stream:
+        # Only the planar averages are built (one xy plane in memory). pot is not returned.
+        header, avgs = grid_cache.read_planar_averages(ipf, use_cache, cache_max, block)
+        pot = None
     else:
-        print("------- Coordination Type Recognition Failed. Calculation ended. -------")
-        sys.exit(1)
-
-    coord=[]
-    for i in range(tot_natoms):
-        coord.append(list(map(lambda x:float(x),ip.readline().split())))
-    ip.readline()
-    grids = list(map(lambda x:int(x),ip.readline().split()))
+        header, pot = grid_cache.read_grid(ipf, use_cache, cache_max, block, nproc)
+    if verbose:
+        print ('* Name of System : ' + header["name"])
+    cell_vec, species, natoms, coord_type, coord = header["cell_vec"], header["species"], header["natoms"], header["coord_type"], header["coord"]
+    grids = header["grid"]
     nx, ny, nz = grids
-    print("* Matrix : [ %d ] x [ %d ] x [ %d ]"%(nx, ny, nz))
-    lines = ip.readlines()
-
-#------------------------------------------------------------
-# From CHG.py (WS)
-    pot = []
-    for x in lines:
-        if "a" in x:
-            break
-        else:
-            tmp = x.split()
-            for y in tmp:
-                pot.append(y)
-    pot = np.reshape(np.array(pot, dtype="d"), (grids[::-1]))
-    # if you want to undo reshape, use command, pot.flatten()
+    if verbose:
+        print("* Matrix : [ %d ] x [ %d ] x [ %d ]"%(nx, ny, nz))
+    # pot is in nz ny nx sequence. if you want to undo reshape, use command, pot.flatten()
 #------------------------------------------------------------
-    if direction in "Z":
+    if stream:
+        potavg=avgs if direction=="ALL" else avgs["XYZ".index(direction)]
+    elif direction=="ALL":
+        # [a, b, c] planar averages
+        potavg=[np.mean(pot, axis=(0,1)), np.mean(pot, axis=(2,0)), np.mean(pot, axis=(1,2))]
+    elif direction in "Z":
     # since chglist is nz ny nx sequence, so if we want nz direction, mean axis will be axis=(1,2)
     # if axis is in tuple type, they calculate average in both direction.
         potavg=np.mean(pot, axis=(1,2))
-    if direction in "Y":
+    elif direction in "Y":
         potavg=np.mean(pot, axis=(2,0))
-    if direction in "X":
+    elif direction in "X":
         potavg=np.mean(pot, axis=(0,1))
-    ip.close()
     return [cell_vec, species, natoms, coord_type, coord], grids, pot, potavg
 
 
 
-def write_Igor2d(x,y,lLabel, bLabel, output, axis_name=""):
-    '''x and y is raw data (np.array type).
-    output is name of output file.'''
-    if os.path.exists(output):
-        print("%s already exists. File substituted to new file."%(igor_output))
-    itx=open(output,'w')
-    itx.write("IGOR\n")
-    itx.write("WAVES/D x_%s %s\n"%(axis_name,axis_name))
-    itx.write("BEGIN\n")
-    for (x1,y1) in zip(x,y):
-        itx.write(str(x1)+" "+str(y1)+"\n")
-    itx.write("END\n")
-    itx.write("X Display %s vs x_%s as \"planar_average_%s\" \n"%(axis_name,axis_name,axis_name))
-    itx.write("X DefaultFont/U \"Times New Roman\"\n")
-    itx.write("X ModifyGraph marker=19\n")
-    itx.write("X ModifyGraph tick=2\n")
-    itx.write("X ModifyGraph mirror=1\n")
-    itx.write("X ModifyGraph fSize=28\n")
-    itx.write("X ModifyGraph lblMargin(left)=15,lblMargin(bottom)=10\n")
-    itx.write("X ModifyGraph standoff=0\n")
-    itx.write("X ModifyGraph axThick=1.5\n")
-    itx.write("X ModifyGraph axisOnTop=1\n")
-    itx.write("X ModifyGraph width=453.543,height=340.157\n")
-    itx.write("X ModifyGraph zero(left)=8\n")
-    itx.write("X ModifyGraph zero(bottom)=1\n")
-    itx.write("X "+lLabel)
-    itx.write("X ModifyGraph axThick=2\n")
-    itx.write("X ModifyGraph lsize=2\n")
-    itx.write("X ModifyGraph lblMargin(left)=5\n")
-    itx.write("X "+bLabel)
-    itx.close()
+# Igor commands of the potential graph (Label left/bottom are added for each graph)
+IGOR_STYLE=["DefaultFont/U \"Times New Roman\"", "ModifyGraph marker=19", "ModifyGraph tick=2", "ModifyGraph mirror=1",
+            "ModifyGraph fSize=28", "ModifyGraph lblMargin(left)=15,lblMargin(bottom)=10", "ModifyGraph standoff=0",
+            "ModifyGraph axThick=1.5", "ModifyGraph axisOnTop=1", "ModifyGraph width=453.543,height=340.157",
+            "ModifyGraph zero(left)=8", "ModifyGraph zero(bottom)=1"]
+
+def igor_graph(name, lLabel, bLabel, macro=False, vacuum=False):
+    '''Igor graph of wave [name] vs x_[name], with its macroscopic average and selected vacuum points.
+    [output] : (traces, title, commands) for igor_itx.write_itx'''
+    traces=[(name,"x_"+name)]
+    commands=list(IGOR_STYLE)+[lLabel,"ModifyGraph axThick=2","ModifyGraph lsize=2","ModifyGraph lblMargin(left)=5",bLabel]
+    if macro:
+        traces.append((name+"_macro","x_"+name))
+        commands.append("ModifyGraph rgb(%s_macro)=(0,0,0)"%(name))
+    if vacuum:
+        traces.append((name+"_vac","x_"+name+"_vac"))
+        commands.append("ModifyGraph mode(%s_vac)=3,rgb(%s_vac)=(0,0,65535)"%(name,name))
+    return traces, "planar_average_"+name, commands
 
 def extract(keyword, file='OUTCAR'):
-    '''Get Fermi Energy Energy from OUTCAR'''
-    with open(file, 'r') as out:
-        for line in out:
-            if keyword in line:
-                return line.split()
+    '''Get Fermi Energy Energy from OUTCAR. The last line with keyword (final step) is used, searched from the end of file.'''
+    line=vasp_out.find_last(file, keyword)
+    if line is not None:
+        return line.split()
 
 def length(a):
     return (a[0]**2+a[1]**2+a[2]**2)**(0.5)
@@ -152,207 +109,648 @@ def dir2car(coord,cell_vec):
     return np.matmul(coord,cell_vec)
 
 
-#------------------------------------------------------------------
-# Starts Script.
-#-----------------------------------------------------------------
-#------------------------------------------------------------------
-# input Direction testing
-#------------------------------------------------------------------
+def macroscopic_average(profiles, periods, resolution):
+    '''Macroscopic average : periodic convolution of planar averages with one or two box windows, using FFT.
+    [input] : profiles (1D array of one planar average, or 2D array (m, n) of m profiles with same grid),
+              periods (window length or [length1, length2] in angstrom, e.g. interlayer distances of two materials),
+              resolution (angstrom per grid along the direction)
+    [output] : macroscopic average with the shape of profiles
+    '''
+    profiles=np.asarray(profiles,dtype='d')
+    n=profiles.shape[-1]
+    spectrum=np.fft.rfft(profiles,axis=-1)
+    for period in np.atleast_1d(periods):
+        # box of [width] grid points centered at 0, fractional weights at both ends
+        width=max(float(period)/resolution,1.0)
+        offsets=np.arange(-int(width//2)-1,int(width//2)+2)
+        weights=np.clip(width/2+0.5-abs(offsets),0,1)
+        kernel=np.zeros(n,dtype='d')
+        np.add.at(kernel,offsets%n,weights)
+        spectrum=spectrum*np.fft.rfft(kernel/kernel.sum())
+    return np.fft.irfft(spectrum,n=n,axis=-1)
+
+
+def find_plateaus(potavg, Ediff=1E-3, periodic=True):
+    '''Flat regions (plateaus) of a planar averaged potential, by run-length segmentation.
+    A grid point i is flat if |potavg[i]-potavg[i-1]| < Ediff. Consecutive flat points make one plateau.
+    periodic=True : potavg[0] is compared with potavg[-1], and a plateau can cross the cell boundary.
+    [input] : potavg (1D array), Ediff, periodic
+    [output] : dict of arrays, ranked (widest first, then smallest std)
+    |-> start : grid index of the first point (plateau is start, start+1, ... (mod n))
+    |-> width : number of points
+    |-> mean, std : potential of the points
+    |-> position : grid index of the center (can be >= n when the plateau crosses the boundary)
+    '''
+    potavg=np.asarray(potavg,dtype='d')
+    n=len(potavg)
+    if periodic:
+        flat=abs(potavg-np.roll(potavg,1))<Ediff
+    else:
+        flat=np.append(False,abs(np.diff(potavg))<Ediff)
+    empty={key:np.zeros(0,dtype=dtype) for (key,dtype) in (("start",int),("width",int),("mean",'d'),("std",'d'),("position",'d'))}
+    if not flat.any():
+        return empty
+    if flat.all():
+        return {"start":np.array([0]), "width":np.array([n]), "mean":np.array([potavg.mean()]),
+                "std":np.array([potavg.std()]), "position":np.array([(n-1)/2.0])}
+
+    # rotate, so that the array starts with a non-flat point : no run crosses the end any more.
+    shift=int(np.argmin(flat)) if periodic else 0
+    flat, values=np.roll(flat,-shift), np.roll(potavg,-shift)
+    edges=np.diff(np.concatenate(([0],flat.view(np.int8),[0])))
+    starts, ends=np.flatnonzero(edges==1), np.flatnonzero(edges==-1)
+    width=ends-starts
+    csum=np.concatenate(([0.],np.cumsum(values)))
+    csq=np.concatenate(([0.],np.cumsum(values*values)))
+    mean=(csum[ends]-csum[starts])/width
+    std=np.sqrt(np.maximum((csq[ends]-csq[starts])/width-mean*mean,0))
+
+    rank=np.lexsort((std,-width))
+    start=(starts[rank]+shift)%n
+    return {"start":start, "width":width[rank], "mean":mean[rank], "std":std[rank], "position":start+(width[rank]-1)/2.0}
+
+
+def plateau_indices(plateaus, i, n):
+    '''[output] : grid indices (mod n) of the i-th plateau of find_plateaus'''
+    return (plateaus["start"][i]+np.arange(plateaus["width"][i]))%n
+
+
+def model_position(structure, ndir, resolution):
+    '''[output] : mean position of the atoms along the direction (in grid index)'''
+    cell_vec, coord_type, coord = structure[0], structure[3], np.array(structure[4],dtype='d')
+    if coord_type=="Direct":
+        return np.mean(dir2car(coord,cell_vec)[:,ndir-1])/resolution[ndir-1]
+    return np.mean(coord[:,ndir-1])/resolution[ndir-1]
+
+
+def select_plateau(plateaus, n, res, width, x_model):
+    '''Choose the vacuum among the plateaus of find_plateaus.
+    [input] : plateaus, n (number of grid points), res (angstrom per grid), width (required width, angstrom),
+              x_model (position of the model in grid index, see model_position)
+    [output] : (index of the selected plateau or None, case)
+    |-> case : "none" (no flat region), "sufficient", "insufficient" (narrower than width),
+               "dipole" (2 wide regions, the one nearer to the model), "many" (more than 2 wide regions, the widest)
+    '''
+    nplateau=len(plateaus["width"])
+    if nplateau==0:
+        return None, "none"
+    # Narrow flat regions (e.g. in the middle of the slab) are not vacuum, if wide ones exist.
+    wide=np.flatnonzero(plateaus["width"]>=width/res)
+    if len(wide)==0:
+        return 0, "insufficient"
+    if len(wide)==1:
+        return wide[0], "sufficient"
+    if len(wide)==2:
+        distance=abs(plateaus["position"][wide]-x_model)%n
+        distance=np.minimum(distance,n-distance)
+        return wide[int(np.argmin(distance))], "dipole"
+    return wide[0], "many"
+
+
+def find_vacuum(potavg, ndir, resolution, structure, log, Ediff=1E-3, width=3.0):
+    '''Find the vacuum level from the planar averaged potential.
+    [input] : potavg, ndir (1/2/3 = a/b/c), resolution (angstrom per grid of each axis),
+              structure ([cell_vec, species, natoms, coord_type, coord] of read_CHGCAR), log (file),
+              Ediff (convergence of flat region, eV), width (required width of vacuum, angstrom)
+    [output] : E_vac, region (grid index of selected flat region or None), E_region (potential of the region or None)
+    '''
+    potavg=np.asarray(potavg,dtype='d')
+    n, res = len(potavg), resolution[ndir-1]
+
+    log.write("--------------------\n")
+    print(">>> Vacuum Level Searching",file=log)
+    print("|---> E_diff for vacuum convergence is %f"%(Ediff),file=log)
+
+    plateaus=find_plateaus(potavg, Ediff)
+    nplateau=len(plateaus["width"])
+    selected, case = select_plateau(plateaus, n, res, width, model_position(structure, ndir, resolution))
+    if case=="none":
+        E_vac=max(potavg)
+        print("|---> No Flat region was found. Maybe Dipole correction or Increasing vacuum level is needed.", file=log)
+        print("|---> For now, max energy is used.", file=log)
+        return E_vac, None, None
+
+    print("|---> %d flat region(s) were found. (rank, width (angstrom), position (angstrom), mean (eV), std (eV))"%(nplateau),file=log)
+    for i in range(min(nplateau,10)):
+        print("|     %3d  %8.3f  %8.3f  %12.6f  %10.3E"%(i+1, plateaus["width"][i]*res, (plateaus["position"][i]%n)*res,
+                                                           plateaus["mean"][i], plateaus["std"][i]),file=log)
+    if case=="sufficient":
+        print("|---> Sufficient vacuum region about %5.3f angstrom width was found."%(plateaus["width"][selected]*res),file=log)
+    elif case=="insufficient":
+        print("|---> Insufficient vacuum region about %5.3f angstrom. Temporarily, this narrow flat region was used as vacuum level. Please check about it."%(plateaus["width"][selected]*res),file=log)
+    elif case=="dipole":
+        print("|---> 2 Flat regions were found. Maybe dipole correction was performed. Please check about it.", file=log)
+        print("|---> If you turn on visualization by -v tags, you can see blue lines. That is the selected region.", file=log)
+    else:
+        print("|---> Too many flat regions were found. Please check the convergence of Vacuum. For now, the widest one is used.", file=log)
+
+    region=plateau_indices(plateaus, selected, n).astype('d')
+    E_region=potavg[region.astype(int)]
+    E_vac=plateaus["mean"][selected]
+    return E_vac, region, E_region
+
+
+def sweep_vacuum(potavg, ndir, resolution, structure, Ediffs, widths):
+    '''Vacuum level for every pair of (Ediff, width). Plateaus are searched once for each Ediff.
+    [output] : list of dict (Ediff, width, case, nplateau, start, width_found (angstrom), position (angstrom), E_vac)
+    '''
+    potavg=np.asarray(potavg,dtype='d')
+    n, res = len(potavg), resolution[ndir-1]
+    x_model=model_position(structure, ndir, resolution)
+    rows=[]
+    for Ediff in Ediffs:
+        plateaus=find_plateaus(potavg, Ediff)
+        for width in widths:
+            selected, case = select_plateau(plateaus, n, res, width, x_model)
+            row={"Ediff":Ediff, "width":width, "case":case, "nplateau":len(plateaus["width"])}
+            if selected is None:
+                row.update(start=None, width_found=0.0, position=None, E_vac=max(potavg))
+            else:
+                row.update(start=int(plateaus["start"][selected]), width_found=plateaus["width"][selected]*res,
+                           position=(plateaus["position"][selected]%n)*res, E_vac=plateaus["mean"][selected])
+            rows.append(row)
+    return rows
+
+
+def write_sweep(filename, rows, fermi_e=None):
+    '''Sweep table (see sweep_vacuum). rows can have "direction".'''
+    out=open(filename,'w')
+    print("# %3s %10s %8s %12s %8s %10s %10s %14s %14s"%("dir","Ediff(eV)","width(A)","case","n_flat","found(A)","pos(A)","E_vac(eV)","WF(eV)"),file=out)
+    for r in rows:
+        position="-" if r["position"] is None else "%.3f"%(r["position"])
+        wf="-" if fermi_e is None else "%.6f"%(r["E_vac"]-fermi_e)
+        print("  %3s %10.3E %8.3f %12s %8d %10.3f %10s %14.6f %14s"%(r.get("direction","-"),r["Ediff"],r["width"],r["case"],
+                                                                  r["nplateau"],r["width_found"],position,r["E_vac"],wf),file=out)
+    out.close()
 
-if direction in "zZcC3":
-    direction="Z"
-    ndir=3
-elif direction in "yYbB2":
-    direction="Y"
-    ndir=2
-elif direction in "xXaA1":
-    direction="X"
-    ndir=1
-else:
-    raise IOError("------- Wrong input of direction. Please set direction again -------")
-    sys.exit(1)
 
 #------------------------------------------------------------------
-# All files are generated in this directory.
+# Library API : reading and evaluation without any file output.
+# Planar averages and Fermi levels are kept in memory while the files are not changed,
+# so a workflow can call these functions many times in one process.
 #------------------------------------------------------------------
-directory="wf_cal"
-mkdir(directory)
-log=open(directory+'/workfunction.log','w')
+MEMORY_CACHE_SIZE=32
+_memory_cache=collections.OrderedDict()
+
+def clear_memory_cache():
+    _memory_cache.clear()
+
+
+def _remember(key, entry):
+    _memory_cache[key]=entry
+    _memory_cache.move_to_end(key)
+    while len(_memory_cache)>MEMORY_CACHE_SIZE:
+        _memory_cache.popitem(last=False)
+    return entry
+
+
+def planar_averages(input_file="LOCPOT", directions=["Z"], use_cache=True, cache_max=grid_cache.MAX_SIZE,
+                    stream=False, block=0, nproc=1, verbose=False):
+    '''Planar averages of input_file along directions, from one reading of the grid.
+    [output] : dict
+    |-> structure : [cell_vec, species, natoms, coord_type, coord]
+    |-> grid : [nx, ny, nz], cell_length : length of a, b, c, resolution : angstrom per grid of a, b, c
+    |-> potavg : dict of direction ("X"/"Y"/"Z") : planar average (read-only np.array)
+    '''
+    key=("grid", tuple(grid_cache.file_key(input_file).values()), block)
+    entry=_memory_cache.get(key)
+    missing=[d for d in directions if entry is None or d not in entry["potavg"]]
+    if missing:
+        values=read_CHGCAR(input_file, missing[0] if len(missing)==1 else "ALL", use_cache, cache_max, stream, block, nproc, verbose)
+        avgs={missing[0]:values[3]} if len(missing)==1 else dict(zip("XYZ",values[3]))
+        for a in avgs.values():
+            a.setflags(write=False)
+        if entry is None:
+            cell_length=np.array([length(v) for v in values[0][0]],dtype='d')
+            entry={"structure":values[0], "grid":values[1], "cell_length":cell_length,
+                   "resolution":cell_length/np.array(values[1],dtype='d'), "potavg":{}}
+        entry["potavg"].update(avgs)
+    return _remember(key, entry)
+
+
+def _fermi_from(filename):
+    try:
+        key=("fermi", tuple(grid_cache.file_key(filename).values()))
+    except OSError:
+        return None
+    if key not in _memory_cache:
+        _remember(key, {"fermi":vasp_out.fermi_energy(filename)})
+    return _remember(key, _memory_cache[key])["fermi"]
+
+
+def fermi_level(outcar="OUTCAR", vasprun="vasprun.xml"):
+    '''Fermi energy of the final step. vasprun.xml is read first (tail-first search, streaming parser only if it fails,
+    see vasp_out.vasprun_values),
+    and OUTCAR only if vasprun.xml doesn't exist or has no efermi.
+    [input] : outcar, vasprun (None : only OUTCAR)
+    [output] : (Fermi energy (eV) or None, name of the file it is taken from or None)'''
+    for filename in (vasprun, outcar):
+        if filename:
+            fermi=_fermi_from(filename)
+            if fermi is not None:
+                return fermi, filename
+    return None, None
+
+
+def evaluate(averages, directions=["Z"], fermi_e=None, vac_con_Ediff=1E-3, vac_con_width=3.0, macro=None, sweep=None, log=None):
+    '''Vacuum level and work function along every direction. No file is written.
+    [input] : averages (see planar_averages), directions, fermi_e (None : work function is not calculated),
+              vac_con_Ediff, vac_con_width (see find_vacuum), macro (see macroscopic_average),
+              sweep (None or (list of Ediff, list of width), see sweep_vacuum), log (file or None)
+    [output] : list of dict for each direction
+    |-> direction (a/b/c), region (None : whole plane), E_vac, E_fermi, workfunction
+    |-> x (distance, angstrom), potavg, macro (or None), vac_x, vac_E (selected vacuum points or None), sweep (or None)
+    '''
+    if log is None:
+        log=io.StringIO()
+    structure, resolution, cell_length = averages["structure"], averages["resolution"], averages["cell_length"]
+    results=[]
+    for direction in directions:
+        ndir="XYZ".index(direction)+1
+        potavg=averages["potavg"][direction]
+        if len(directions)>1:
+            log.write("====================\n")
+            log.write("Direction : [ %s ]\n"%("abc"[ndir-1]))
+
+        #------------------------------------------------------------------
+        # Get E_vacuum from average potential along the direction.
+        #------------------------------------------------------------------
+        E_vac, region, E_region = find_vacuum(potavg, ndir, resolution, structure, log, vac_con_Ediff, vac_con_width)
+        rows=None
+        if sweep:
+            rows=sweep_vacuum(potavg, ndir, resolution, structure, sweep[0], sweep[1])
+            for r in rows:
+                r["direction"]="abc"[ndir-1]
+            E_sweep=np.array([r["E_vac"] for r in rows])
+            log.write("Sweep of %d Ediff x %d width : E_vac from [ %.6f ] to [ %.6f ] eV (spread %.6f eV), cases : %s\n"
+                      %(len(sweep[0]),len(sweep[1]),E_sweep.min(),E_sweep.max(),E_sweep.max()-E_sweep.min(),", ".join(sorted(set(r["case"] for r in rows)))))
+
+        #------------------------------------------------------------------
+        # Calculate Workfunction Value. (Workfunction = Vacuum Level - Fermi Level)
+        #------------------------------------------------------------------
+        log.write("Vacuum Level is [ %5.10s ] eV.\n"%(E_vac))
+        if fermi_e is not None:
+            log.write("So Workfunction is [ %5.10s ] eV.\n"%(E_vac-fermi_e))
+        else:
+            log.write("Workfunction = [ None ]\n")
+        log.write("--------------------\n")
+        results.append({"direction":"abc"[ndir-1], "region":None, "E_vac":E_vac, "E_fermi":fermi_e,
+                        "workfunction":None if fermi_e is None else E_vac-fermi_e,
+                        "x":np.arange(1,len(potavg)+1,1)*cell_length[ndir-1]/float(len(potavg)), "potavg":potavg,
+                        "macro":macroscopic_average(potavg,macro,resolution[ndir-1]) if macro else None,
+                        "vac_x":None if region is None else (region+1)*resolution[ndir-1], "vac_E":E_region, "sweep":rows})
+    return results
+
+
+def evaluate_regions(input_file, averages, regions, fermi_e=None, vac_con_Ediff=1E-3, vac_con_width=3.0,
+                     use_cache=True, cache_max=grid_cache.MAX_SIZE, block=0, log=None):
+    '''Vacuum level and work function of the potential averaged over in-plane regions along c (see grid_sat).
+    [input] : regions (list of (x0, x1, y0, y1) in fractional coordinates), others as evaluate
+    [output] : profiles (np.array (number of regions, nz)), list of dict (see evaluate) for each region
+    '''
+    if log is None:
+        log=io.StringIO()
+    header, table = grid_sat.read_table(input_file, use_cache, cache_max, block)
+    windows=[grid_sat.window_index(table,(r[0],r[1]),(r[2],r[3])) for r in regions]
+    profiles=grid_sat.region_profiles(table,windows)
+    results=[]
+    for (k,(r,profile)) in enumerate(zip(regions,profiles)):
+        log.write("====================\n")
+        log.write("Region %d : x [ %s ~ %s ], y [ %s ~ %s ] (fractional), along c\n"%(k+1,r[0],r[1],r[2],r[3]))
+        E_vac, region, E_region = find_vacuum(profile, 3, averages["resolution"], averages["structure"], log, vac_con_Ediff, vac_con_width)
+        log.write("Vacuum Level is [ %5.10s ] eV.\n"%(E_vac))
+        if fermi_e is not None:
+            log.write("So Workfunction is [ %5.10s ] eV.\n"%(E_vac-fermi_e))
+        log.write("--------------------\n")
+        results.append({"direction":"c", "region":k+1, "E_vac":E_vac, "E_fermi":fermi_e,
+                        "workfunction":None if fermi_e is None else E_vac-fermi_e})
+    return profiles, results
+
+
+def calculate(input_file="LOCPOT", fermi_e=None, directions=["Z"], outcar="OUTCAR", vac_con_Ediff=1E-3, vac_con_width=3.0,
+              macro=None, use_cache=True, cache_max=grid_cache.MAX_SIZE, stream=False, block=0, nproc=1, vasprun="vasprun.xml"):
+    '''Work function of one LOCPOT without any file output (see evaluate).
+    fermi_e : None means the Fermi energy of the final step (vasprun, or outcar, see fermi_level)
+    '''
+    if fermi_e is None:
+        fermi_e=fermi_level(outcar, vasprun)[0]
+    averages=planar_averages(input_file, directions, use_cache, cache_max, stream, block, nproc)
+    return evaluate(averages, directions, fermi_e, vac_con_Ediff, vac_con_width, macro)
+
 
 #------------------------------------------------------------------
-# Extract fermi energy if 'OUTCAR' file exists in same directory
-#------------------------------------------------------------------
-if os.path.exists(input_file):
-    print("--------------        {} exists. Calculation starts.        --------------".format(input_file))
-    log.write(input_file+" exists. Calculation starts\n")
-    log.write("--------------------\n")
-    log.write("input file = "+input_file+'\n')
-    log.write("output file = "+output_file+'\n')
+# Starts Script.
+#-----------------------------------------------------------------
+def parse_direction(direction):
+    '''[output] : list of directions ("X"/"Y"/"Z") from the -d input'''
+    if direction.lower() in ("all", "abc", "xyz", "123"):
+        # planar averages along every axis from one reading of the grid
+        return ["X","Y","Z"]
+    elif direction in "zZcC3":
+        return ["Z"]
+    elif direction in "yYbB2":
+        return ["Y"]
+    elif direction in "xXaA1":
+        return ["X"]
+    raise IOError("------- Wrong input of direction. Please set direction again -------")
 
-    #------------------------------------------------------------------
-    # Get the potential
-    #-----------------------------------------------------------------
-    values=read_CHGCAR(input_file, direction)
-    potavg, grids, cell_vec = values[3], np.array(values[1],dtype='d'), np.array(values[0][0],dtype='d')
-    cell_vec_length = np.array((length(values[0][0][0]), length(values[0][0][1]), length(values[0][0][2])),dtype='d')
-    resolution=cell_vec_length/grids
 
+def workfunction(input_file="LOCPOT", output_file="output.dat", fermi_e=0, directions=["Z"], visualization=False,
+                 igor=False, igor_output="Potential", vac_con_Ediff=1E-3, vac_con_width=3.0, use_cache=True,
+                 cache_max=grid_cache.MAX_SIZE, stream=False, block=0, nproc=1, directory="wf_cal", outcar="OUTCAR", macro=None, regions=None, plot=None, sweep=None, verbose=True,
+                 vasprun="vasprun.xml", save_profiles=False):
+    '''Work function calculation of one LOCPOT. Every file is written in [directory] (see calculate for no file output).
+    macro : None or window length(s) in angstrom of macroscopic average (see macroscopic_average)
+    regions : None or list of in-plane windows (x0, x1, y0, y1) in fractional coordinates. The potential averaged
+              over each window along c is written in region_[output_file], with its vacuum level (see grid_sat)
+    plot : None or format of the image of each profile (eps, png, ...). Profiles to draw are saved as .npz (see gyp_plot)
+    sweep : None or (list of Ediff, list of width). Vacuum level of every pair is written in sweep_[output_file]
+    verbose : False = nothing is printed on screen
+    vasprun : Fermi energy is taken from this file first, and from outcar if needed (see fermi_level)
+    save_profiles : True = profiles are saved as .npz without plot, to be drawn later (batch mode)
+    [output] : list of dict for each direction (see evaluate) and region, or None if input_file doesn't exist
+    '''
+    say=print if verbose else (lambda *args, **kwargs: None)
     #------------------------------------------------------------------
-    # Get E_vacuum from average potential along the direction.
+    # All files are generated in this directory.
     #------------------------------------------------------------------
-    potavg_temp=np.append(np.array([0],dtype='d'),potavg[:-1])
-    diff_potavg=abs(potavg-potavg_temp)
+    mkdir(directory)
+    log=open(directory+'/workfunction.log','w')
+    results=[]
 
+    #------------------------------------------------------------------
+    # Not ended well
+    #------------------------------------------------------------------
+    if not os.path.exists(input_file):
+        log.write(input_file+" doesn't existed... Just Ended")
+        log.close()
+        return None
 
+    say("--------------        {} exists. Calculation starts.        --------------".format(input_file))
+    log.write(input_file+" exists. Calculation starts\n")
     log.write("--------------------\n")
-    print(">>> Vacuum Level Searching",file=log)
-    print("|---> E_diff for vacuum convergence is %f"%(vac_con_Ediff),file=log)
-
-
-    temp, x_temp =[], []
-    for i in range(len(diff_potavg)):
-        if diff_potavg[i]<(vac_con_Ediff):
-            temp.append(potavg[i])
-            x_temp.append(i)
-    x_temp=np.array(x_temp,dtype='d')
-    coord=np.array(values[0][4],dtype='d')
-
-    if len(x_temp)==0:
-        print("|---> No Flat region was found. Maybe Dipole correction or Increasing vacuum level is needed.", file=log)
-    else:
-        diff_x_temp=x_temp-np.append(np.array([0],dtype='d'),x_temp[:-1])
-        n=0
-        for i in diff_x_temp[1:]:
-            if i!=1:
-                n+=1
-    if n==0:
-        E_vac=np.mean(temp)
-        if len(x_temp)>=vac_con_width/resolution[ndir-1]:
-            print("|---> Sufficient vacuum region about %5.3f angstrom width was found."%(len(x_temp)*resolution[ndir-1]),file=log)
-        else: 
-            print("|---> Insufficient vacuum region about %5.3f angstrom. Temporarily, this narrow flat region was used as vacuum level. Please check about it."%(len(x_temp)*resolution[ndir-1]),file=log)
-    elif n==1:
-        for i in range(len(diff_x_temp[1:])):
-            if diff_x_temp[i]!=1:
-                discrete=i
-        region_a=np.mean(x_temp[:discrete])
-        region_b=np.mean(x_temp[discrete:])
-        if values[0][3]=="Direct":
-            x_model=np.mean(dir2car(coord,cell_vec))/resolution[ndir-1]
-        else:
-            x_model=np.mean(coord[:,2])/resolution[ndir-1]
-        if abs(x_model-region_a) <= abs(x_model-region_b):
-            region=np.array(x_temp[:discrete],dtype='d')
-            E_region=np.array(temp[:discrete],dtype='d')
-        else:
-            region=np.array(x_temp[discrete:],dtype='d')
-            E_region=np.array(temp[discrete:],dtype='d')
-        E_vac=np.mean(E_region)
-        print("|---> 2 Flat regions were found. Maybe dipole correction was performed. Please check about it.", file=log)
-        print("|---> If you turn on visualization by -v tags, you can see blue lines. That is the selected region.", file=log)
-    else:
-        E_vac=max(temp)
-        print("|---> Too many flat regions were found. Please check the convergence of Vacuum. For now, max energy is used.", file=log)
+    log.write("input file = "+input_file+'\n')
+    log.write("output file = "+output_file+'\n')
 
+    #------------------------------------------------------------------
+    # Get the potential
+    #-----------------------------------------------------------------
+    averages=planar_averages(input_file, directions, use_cache, cache_max, stream, block, nproc, verbose)
 
     #------------------------------------------------------------------
+    # Extract fermi energy if 'OUTCAR' file exists in same directory
     # Shifting potential values with respect to E_fermi (default E_fermi = 0.0)
     #------------------------------------------------------------------
-    shifting=True            
+    shifting=True
     if fermi_e+1==1:
-        try:
-            # fermi_e = float(extract('efermi','vasprun.xml')[2])
-            fermi_e=float(extract('E-fermi','OUTCAR')[2])
+        fermi_e, source = fermi_level(outcar, vasprun)
+        if fermi_e is not None:
             log.write("--------------------\n")
-            log.write("Fermi energy= [ "+str(fermi_e)+" ] eV.\n")
-            lLabel="Label left \"\Z24\F'Times New Roman'\\f02E\\f00\BPOT\M\Z24 (eV) (\\f02E\\f00-\\f02E\\f00\Bf\M)\"\n"
-        except:
-            shifting=False
+            log.write("Fermi energy= [ "+str(fermi_e)+" ] eV. (from "+source+")\n")
+            lLabel="Label left \"\\Z24\\F'Times New Roman'\\f02E\\f00\\BPOT\\M\\Z24 (eV) (\\f02E\\f00-\\f02E\\f00\\Bf\\M)\"\n"
+        else:
+            shifting, fermi_e = False, 0
             log.write("--------------------\n")
             log.write("OUTCAR file doesn't existed\n")
             log.write("[WARNING] Fermi energy is not extracted. Shifting is not done\n")
-            print("OUTCAR file doesn't existed")
-            print("[WARNING] fermi energy is not extracted. Shifting is not done")
-            lLabel="Label left \"\Z24\F'Times New Roman'\\f02E\\f00\BPOT\M\Z24 (eV)\"\n"
+            say("OUTCAR file doesn't existed")
+            say("[WARNING] fermi energy is not extracted. Shifting is not done")
+            lLabel="Label left \"\\Z24\\F'Times New Roman'\\f02E\\f00\\BPOT\\M\\Z24 (eV)\"\n"
     else:
         log.write("--------------------\n")
-        print("OUTCAR file doesn't existed")
-        print("(Manual setting) Fermi Energy is successfully set.")
+        say("OUTCAR file doesn't existed")
+        say("(Manual setting) Fermi Energy is successfully set.")
         log.write("OUTCAR file doesn't existed\n")
         log.write("(Manually set) Fermi energy= ["+str(fermi_e)+" ] eV.\n")
         log.write("--------------------\n")
-        lLabel="Label left \"\Z24\F'Times New Roman'\\f02E\\f00\BPOT\M\Z24 (eV) (\\f02E\\f00-\\f02E\\f00\Bf\M)\"\n"
-    shifted_potavg=potavg-fermi_e
-
-    #------------------------------------------------------------------
-    # Calculate Workfunction Value. (Workfunction = Vacuum Level - Fermi Level)
-    #------------------------------------------------------------------
-
-    log.write("Vacuum Level is [ %5.10s ] eV.\n"%(E_vac))
-    if shifting:
-        log.write("So Workfunction is [ %5.10s ] eV.\n"%(E_vac-fermi_e))
-    else:
-        log.write("Workfunction = [ None ]\n")
-    log.write("--------------------\n")
+        lLabel="Label left \"\\Z24\\F'Times New Roman'\\f02E\\f00\\BPOT\\M\\Z24 (eV) (\\f02E\\f00-\\f02E\\f00\\Bf\\M)\"\n"
 
+    results=evaluate(averages, directions, fermi_e if shifting else None, vac_con_Ediff, vac_con_width, macro, sweep, log)
 
+    outdat=open(directory+"/"+output_file,'w')
+    itx_waves, itx_graphs, plot_jobs = [], [], []
+    for (direction, r) in zip(directions, results):
+        # With several directions, every output has the name of the axis (a/b/c)
+        suffix="" if len(directions)==1 else "_"+r["direction"]
+        shifted_potavg=r["potavg"]-fermi_e
+        shifted_macro=None if r["macro"] is None else r["macro"]-fermi_e
+        vac_E=None if r["vac_E"] is None else r["vac_E"]-fermi_e
+
+        #------------------------------------------------------------------
+        # Visualization -- Total
+        #------------------------------------------------------------------
+        index=np.arange(1,len(shifted_potavg)+1,1)
+
+        # every direction is written in one data file, as blocks separated by a blank line.
+        if len(directions)>1:
+            print("# direction %s"%(r["direction"]),file=outdat)
+        if shifted_macro is not None:
+            for (x1,y1,m1) in zip(index,shifted_potavg,shifted_macro):
+                print((str(x1)+" "+str(y1)+" "+str(m1)),file=outdat)
+        else:
+            for (x1,y1) in zip(index,shifted_potavg):
+                print((str(x1)+" "+str(y1)),file=outdat)
+        if len(directions)>1:
+            print("\n",file=outdat)
+
+        #------------------------------------------------------------------
+        # Visualization (1) Igor
+        #------------------------------------------------------------------
+        if igor==True:
+            # every direction (and its macroscopic average / vacuum points) goes to one itx file
+            name="Ep"+suffix
+            #lLabel is written in upper parts. Since it must be differnent case by case.
+            bLabel="Label bottom \"Distance along \\f02%s\\f00 (\\{num2char(197)})\"\n"%(direction.lower())
+            itx_waves+=[("x_"+name,r["x"]),(name,shifted_potavg)]
+            if shifted_macro is not None:
+                itx_waves.append((name+"_macro",shifted_macro))
+            if vac_E is not None:
+                itx_waves+=[("x_"+name+"_vac",r["vac_x"]),(name+"_vac",vac_E)]
+            itx_graphs.append(igor_graph(name,lLabel,bLabel,shifted_macro is not None,vac_E is not None))
+
+        #------------------------------------------------------------------
+        # Visualization (2) matplotlib.pyplot : profile is saved only if it is drawn, after the calculation (see gyp_plot.py)
+        #------------------------------------------------------------------
+        if plot or save_profiles:
+            profile=directory+"/"+'Potential%s.npz'%(suffix)
+            gyp_plot.save_profile(profile, r["x"], shifted_potavg, shifted_macro, r["vac_x"], vac_E)
+            r["profile"]=profile
+        if plot:
+            plot_jobs.append((profile, directory+"/"+'Potential%s.%s'%(suffix,plot)))
+    outdat.close()
+    if macro:
+        log.write("Macroscopic average with window [ %s ] angstrom is written in the 3rd column of [ %s ].\n"%(", ".join(str(m) for m in macro),output_file))
+    if sweep:
+        write_sweep(directory+"/sweep_"+output_file, [row for r in results for row in r["sweep"]], fermi_e if shifting else None)
+        log.write("Sweep of vacuum convergence settings is written in [ sweep_%s ]\n"%(output_file))
+    if igor==True:
+        igor_name=igor_output[:-4] if igor_output.endswith(".itx") else igor_output
+        igor_name+=".itx"
+        if os.path.exists(directory+"/"+igor_name):
+            say("%s already exists. File substituted to new file."%(directory+"/"+igor_name))
+        igor_itx.write_itx(directory+"/"+igor_name,itx_waves,itx_graphs)
+        log.write("Successfully finished writing itx file which name is [ %s ]\n"%(igor_name))
+    for (profile, image) in plot_jobs:
+        gyp_plot.render(profile, image, visualization)
 
     #------------------------------------------------------------------
-    # Visualization -- Total
+    # Potential averaged over in-plane regions along c (summed-area table of xy planes)
     #------------------------------------------------------------------
-    index=np.arange(1,len(potavg)+1,1)
-    if direction == "Z":
-        real_index=index*cell_vec_length[2]/float(len(potavg))
-    elif direction == "Y" :
-        real_index=index*cell_vec_length[1]/float(len(potavg))
-    else:
-        # direction == "X"
-        real_index=index*cell_vec_length[0]/float(len(potavg))
+    if regions:
+        profiles, region_results = evaluate_regions(input_file, averages, regions, fermi_e if shifting else None,
+                                                    vac_con_Ediff, vac_con_width, use_cache, cache_max, block, log)
+        regout=open(directory+"/region_"+output_file,'w')
+        print("# index "+" ".join("region%d"%(k+1) for k in range(len(regions))),file=regout)
+        for (i,row) in enumerate(profiles.T-fermi_e):
+            print(str(i+1)+" "+" ".join(str(v) for v in row),file=regout)
+        regout.close()
+        results+=region_results
+        log.write("Averages over the regions are written in [ region_%s ]\n"%(output_file))
 
     #------------------------------------------------------------------
     # Successfully Ended.
     #------------------------------------------------------------------    
-    print("--------------         Workfunction Calculation is Done.        --------------")
-    print("-------------- Please kindly look at [ workfunction.log ] file. --------------")
-    outdat=open(directory+"/"+output_file,'w')
-    for (x1,y1) in zip(index,shifted_potavg):
-        print((str(x1)+" "+str(y1)),file=outdat)
-    outdat.close()
-       
-    
-    #------------------------------------------------------------------
-    # Visualization (1) Igor
-    #------------------------------------------------------------------
-    if igor==True:
-        if ".itx" not in igor_output:
-            igor_output+=".itx"
-        #lLabel is written in upper parts. Since it must be differnent case by case.
-        bLabel="Label bottom \"Distance along \\f02%s\\f00 (\\{num2char(197)})\"\n"%(direction.lower())
-        write_Igor2d(real_index,shifted_potavg,lLabel,bLabel,directory+"/"+igor_output,"Ep")
-        log.write("Successfully finished writing itx file which name is [ %s ]"%(igor_output))
-        
-    #------------------------------------------------------------------
-    # Visualization (2) matplotlib.pyplot
-    #------------------------------------------------------------------
-        import matplotlib.pyplot as plt
-        X, Y = real_index, shifted_potavg
-        plt.plot(X,Y,'r')
-        if n!=0:
-            # If there are dipole corrections
-            selected_X, selected_Y = region, E_region-fermi_e
-            plt.plot(selected_X*resolution[ndir-1],selected_Y,'bo')
-        plt.savefig(directory+"/"+'Potential.eps')
-        if not(visualization):
-            import matplotlib
-            matplotlib.use("Agg")
-        else:
-            plt.show()
-        
-        log.close()
+    say("--------------         Workfunction Calculation is Done.        --------------")
+    say("-------------- Please kindly look at [ workfunction.log ] file. --------------")
+    log.close()
+    return results
+
 
 #------------------------------------------------------------------
-# Not ended well
+# Batch mode : many calculation directories in a process pool
 #------------------------------------------------------------------
-else:
-    log.write(input_file+" doesn't existed... Just Ended")
-    log.close()
+def batch_job(path, options):
+    '''One directory (or LOCPOT path) of batch mode. Outputs are in [directory]/wf_cal, OUTCAR of the directory is used.
+    [output] : (directory, list of results or None, error message or None)'''
+    if os.path.isdir(path):
+        dirname, input_file=path, os.path.join(path, options["input_file"])
+    else:
+        dirname, input_file=os.path.dirname(path) or ".", path
+    # images are drawn by run_batch after every calculation, and results are reported in its summary
+    kwargs=dict(options, input_file=input_file, directory=os.path.join(dirname, "wf_cal"),
+                outcar=os.path.join(dirname, "OUTCAR"), visualization=False, plot=None, verbose=False,
+                save_profiles=bool(options.get("plot")),
+                vasprun=os.path.join(dirname, options["vasprun"]) if options.get("vasprun") else None)
+    try:
+        results=workfunction(**kwargs)
+    except Exception:
+        return dirname, None, traceback.format_exc().strip().splitlines()[-1]
+    if results is None:
+        return dirname, None, "%s doesn't exist"%(input_file)
+    return dirname, results, None
+
+
+def _collect(paths, options, workers, jobs, index=None):
+    '''Run batch_job of paths in a pool of [workers] processes, one future per path, and store the results in jobs[index[i]].
+    [output] : list of index of the paths whose worker died (BrokenProcessPool), they are stored as failed'''
+    index=list(range(len(paths))) if index is None else index
+    broken=[]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures={pool.submit(batch_job, path, options):i for (i, path) in zip(index, paths)}
+        for future in as_completed(futures):
+            i=futures[future]
+            path=paths[index.index(i)]
+            dirname=path if os.path.isdir(path) else (os.path.dirname(path) or ".")
+            try:
+                jobs[i]=future.result()
+            except BrokenProcessPool:
+                broken.append(i)
+                jobs[i]=(dirname, None, "worker process died (killed or out of memory)")
+            except Exception as error:
+                jobs[i]=(dirname, None, "%s: %s"%(type(error).__name__, error))
+    return sorted(broken)
+
+
+def run_batch(pattern, options, workers=1, summary="wf_summary.dat"):
+    '''Work function of every directory (or LOCPOT path) matched by the glob [pattern], with [workers] processes.
+    A failed directory is reported in the summary, and the others go on.
+    [output] : list of (directory, results, error) in the order of the paths'''
+    paths=sorted(glob.glob(pattern))
+    if len(paths)==0:
+        raise IOError("------- Nothing matches [ %s ] -------"%(pattern))
+    print("--------------        Batch mode : %d path(s), %d worker(s)        --------------"%(len(paths), workers))
+    if workers==1:
+        jobs=[batch_job(path, options) for path in paths]
+    else:
+        jobs=[None]*len(paths)
+        broken=_collect(paths, options, workers, jobs)
+        # when a worker dies (killed, out of memory, ...) the pool fails every unfinished path,
+        # so each of them is tried again alone : only the path which kills its worker again fails
+        for i in broken:
+            _collect([paths[i]], options, 1, jobs, [i])
+
+    if options.get("plot"):
+        plots=[(r["profile"], os.path.splitext(r["profile"])[0]+"."+options["plot"])
+               for (dirname, results, error) in jobs if error is None for r in results if "profile" in r]
+        for (image, error) in gyp_plot.render_batch(plots, workers):
+            if error is not None:
+                print("[WARNING] %s is not drawn. %s"%(image, error))
+
+    nfail=0
+    with open(summary,'w') as out:
+        print("# %-38s %4s %14s %14s %14s  %s"%("directory","dir","E_vac(eV)","E_fermi(eV)","WF(eV)","status"),file=out)
+        for (dirname, results, error) in jobs:
+            if error is not None:
+                nfail+=1
+                print("  %-38s %4s %14s %14s %14s  FAILED: %s"%(dirname,"-","-","-","-",error),file=out)
+                continue
+            for r in results:
+                fermi="-" if r["E_fermi"] is None else "%.6f"%(r["E_fermi"])
+                wf="-" if r["workfunction"] is None else "%.6f"%(r["workfunction"])
+                name=r["direction"] if r.get("region") is None else "%s%d"%(r["direction"],r["region"])
+                print("  %-38s %4s %14.6f %14s %14s  ok"%(dirname,name,r["E_vac"],fermi,wf),file=out)
+    print("--------------   %d done, %d failed. Summary is written in [ %s ]   --------------"%(len(jobs)-nfail, nfail, summary))
+    return jobs
+
+
+def main():
+    pars = argparse.ArgumentParser()
+    pars.add_argument('-i',type=str,default='LOCPOT',help="* Name of input file. default=LOCPOT")
+    pars.add_argument('-o', type=str,default='output.dat',help="* Name of output file (data file). If fermi value is existed (both manually input or extracted), it automatically shift the value.")
+    pars.add_argument("-fermi", help="* Set fermi level Manually", type=float, default=0)
+    pars.add_argument('-v', help="* If you want to see the plot, turn this on", action='store_true')
+    pars.add_argument('-igor',help='* If you want to get .itx file(Igor format), turn this on', action="store_true")
+    pars.add_argument('-igor_o',type=str,default='Potential',help="* Name of Igor output file")
+    pars.add_argument('-d',type=str,default='z',help="Wanted direction. You can set a/b/c or x/y/z or 1/2/3 for the direction. 'all' : every direction from one reading of the grid.")
+    pars.add_argument('--vac_Ediff', default=1E-3, type=float, help="Vacuum region convergence Ediff")
+    pars.add_argument('--vac_width', default=3.0, type=float, help="Vacuum region convergence width. Unit is angstrom")
+    pars.add_argument('--block', default=0, type=int, help="Which grid of the file is used. 0=first grid (default), 1=second grid (e.g. magnetization of spin-polarized CHGCAR)")
+    pars.add_argument('--nproc', default=1, type=int, help="Number of processes to parse the grid. 0 = every core. default=1")
+    pars.add_argument('--stream', help="* Build the planar average while reading the grid (memory is bounded by one xy plane)", action='store_true')
+    pars.add_argument('--nocache', help="* Do not use (read or write) the binary cache of parsed grid", action='store_true')
+    pars.add_argument('--clear_cache', help="* Remove every cached grid before the calculation", action='store_true')
+    pars.add_argument('--cache_max', default=20, type=float, help="Maximum total size of cached grids. Unit is GB. default=20")
+    pars.add_argument('--macro', default=None, type=float, nargs='+', help="* Macroscopic average with window length(s) in angstrom. 1 or 2 values (e.g. interlayer distances of both sides of interface)")
+    pars.add_argument('--region', default=None, type=float, nargs=4, action='append', metavar=('X0','X1','Y0','Y1'), help="* In-plane window (fractional coordinates) to average the potential along c. Can be repeated. X1<X0 crosses the cell boundary")
+    pars.add_argument('--plot', default=None, type=str, help="* Format of profile images (eps, png, pdf, ...). default=eps with -igor or -v, otherwise no image")
+    pars.add_argument('--sweep_Ediff', default=None, type=float, nargs='+', help="* Sweep mode : Ediff values to test. Grid is read once, the result of every (Ediff, width) is written in sweep_[output]")
+    pars.add_argument('--sweep_width', default=None, type=float, nargs='+', help="* Sweep mode : vacuum width values (angstrom) to test. default=--vac_width")
+    pars.add_argument('--vasprun', default='vasprun.xml', type=str, help="* Fermi energy is read from this file first (OUTCAR if it doesn't exist). '' = only OUTCAR. default=vasprun.xml")
+    pars.add_argument('--batch', default=None, type=str, help="* Glob of calculation directories (or LOCPOT paths), e.g. 'slab_*'. Each result is written in [directory]/wf_cal")
+    pars.add_argument('-j', default=1, type=int, help="Number of worker processes of batch mode. default=1")
+    pars.add_argument('--summary', default="wf_summary.dat", type=str, help="Summary table of batch mode. default=wf_summary.dat")
+    args = pars.parse_args()
+    input_file, fermi_e, output_file, visualization, igor, igor_output,direction=args.i, args.fermi, args.o, args.v, args.igor, args.igor_o, args.d
+    vac_con_Ediff, vac_con_width = args.vac_Ediff, args.vac_width
+    use_cache, cache_max = not(args.nocache), int(args.cache_max*1024**3)
+    stream, block, nproc = args.stream, args.block, args.nproc
+    directions=parse_direction(direction)
+    if args.clear_cache:
+        grid_cache.clear_cache()
+    options=dict(input_file=input_file, output_file=output_file, fermi_e=fermi_e, directions=directions, visualization=visualization,
+                 igor=igor, igor_output=igor_output, vac_con_Ediff=vac_con_Ediff, vac_con_width=vac_con_width, use_cache=use_cache,
+                 cache_max=cache_max, stream=stream, block=block, nproc=nproc, macro=args.macro, regions=args.region,
+                 plot=args.plot if args.plot is not None else ("eps" if (igor or visualization) else None),
+                 sweep=None if (args.sweep_Ediff is None and args.sweep_width is None) else
+                       (args.sweep_Ediff or [vac_con_Ediff], args.sweep_width or [vac_con_width]),
+                 vasprun=args.vasprun or None)
+    if args.macro is not None and not(1<=len(args.macro)<=2):
+        raise IOError("------- --macro takes 1 or 2 window lengths -------")
+    if args.batch is not None:
+        run_batch(args.batch, options, args.j, args.summary)
+    else:
+        workfunction(**options)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,8 @@ import math
 import numpy as np
 import argparse
 import os
+import vasp_out
+import igor_itx
 
 ##############################################################
 ## -------------------Explanation------------------
@@ -32,32 +34,14 @@ def write_Igor2d(x,y,output, axis_name=""):
     import os
     if os.path.exists(output):
         print("%s already exists. File substituted to new file."%(igor_output))
-    itx=open(output,'w')
-    itx.write("IGOR\n")
-    itx.write("WAVES/D x_%s %s\n"%(axis_name,axis_name))
-    itx.write("BEGIN\n")
-    for (x1,y1) in zip(x,y):
-        itx.write(str(x1)+" "+str(y1)+"\n")
-    itx.write("END\n")
-    itx.write("X Display %s vs x_%s as \"planar_average_%s\" \n"%(axis_name,axis_name,axis_name))
-    itx.write("X DefaultFont/U \"Times New Roman\"\n")
-    itx.write("X ModifyGraph marker=19\n")
-    itx.write("X ModifyGraph tick=2\n")
-    itx.write("X ModifyGraph mirror=1\n")
-    itx.write("X ModifyGraph fSize=28\n")
-    itx.write("X ModifyGraph lblMargin(left)=15,lblMargin(bottom)=10\n")
-    itx.write("X ModifyGraph standoff=0\n")
-    itx.write("X ModifyGraph axThick=1.5\n")
-    itx.write("X ModifyGraph axisOnTop=1\n")
-    itx.write("X ModifyGraph width=453.543,height=340.157\n")
-    itx.write("X ModifyGraph zero(left)=8\n")
-    itx.write("X ModifyGraph zero(bottom)=1\n")
-    itx.write("X Label left \"\Z24\F'Times New Roman'\\f02E\\f00\BPOT\M\Z24 (eV) (\\f02E\\f00-\\f02E\\f00\Bf\M)\"\n")
-    itx.write("X ModifyGraph axThick=2\n")
-    itx.write("X ModifyGraph lsize=2\n")
-    itx.write("X ModifyGraph lblMargin(left)=5\n")
-    itx.write("X Label bottom \"Distance along \\f02z\\f00 (\\{num2char(197)})\"\n")
-    itx.close()
+    commands=["DefaultFont/U \"Times New Roman\"", "ModifyGraph marker=19", "ModifyGraph tick=2", "ModifyGraph mirror=1",
+              "ModifyGraph fSize=28", "ModifyGraph lblMargin(left)=15,lblMargin(bottom)=10", "ModifyGraph standoff=0",
+              "ModifyGraph axThick=1.5", "ModifyGraph axisOnTop=1", "ModifyGraph width=453.543,height=340.157",
+              "ModifyGraph zero(left)=8", "ModifyGraph zero(bottom)=1",
+              "Label left \"\\Z24\\F'Times New Roman'\\f02E\\f00\\BPOT\\M\\Z24 (eV) (\\f02E\\f00-\\f02E\\f00\\Bf\\M)\"",
+              "ModifyGraph axThick=2", "ModifyGraph lsize=2", "ModifyGraph lblMargin(left)=5",
+              "Label bottom \"Distance along \\f02z\\f00 (\\{num2char(197)})\""]
+    igor_itx.write_itx(output,[("x_"+axis_name,x),(axis_name,y)],[([(axis_name,"x_"+axis_name)],"planar_average_"+axis_name,commands)])
 
 
 log=open('workfunction.log','w')
@@ -88,10 +72,10 @@ if os.path.exists(input_file):
     # Get Fermi Energy Energy from OUTCAR
     #------------------------------------------------------------------
     def extract(keyword, file='OUTCAR'):
-        with open(file, 'r') as out:
-            for line in out:
-                if keyword in line:
-                    return line.split()
+        # last line with keyword (final step), searched from the end of file
+        line=vasp_out.find_last(file, keyword)
+        if line is not None:
+            return line.split()
 
     shifting=True            
     if fermi_e==0:
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+import os
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+##########################################################################
+## Plotting stage of gyp.py                                             ##
+## gyp.py saves every profile to draw (--plot) as [name].npz            ##
+## (x, y, and optional macro / vac_x / vac_y), and they are drawn here. ##
+## matplotlib is imported only when something is drawn, with the        ##
+## non-interactive backend unless the plot has to be shown.             ##
+## $ python gyp_plot.py */wf_cal/*.npz -f png -j 8                      ##
+##########################################################################
+
+
+def pyplot(show=False):
+    '''matplotlib.pyplot, imported on first use. Backend is set before pyplot is imported (Agg if not show).'''
+    if "matplotlib.pyplot" not in sys.modules:
+        import matplotlib
+        if not show:
+            matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    if not show and plt.get_backend().lower() != "agg":
+        plt.switch_backend("Agg")
+    return plt
+
+
+def save_profile(filename, x, y, macro=None, vac_x=None, vac_y=None):
+    '''Save one profile for the plotting stage (.npz)'''
+    profile = {"x": x, "y": y}
+    if macro is not None:
+        profile["macro"] = macro
+    if vac_x is not None:
+        profile["vac_x"], profile["vac_y"] = vac_x, vac_y
+    np.savez(filename, **profile)
+
+
+def load_profile(filename):
+    with np.load(filename) as f:
+        return {k: f[k] for k in f.files}
+
+
+def render(profile, filename, show=False):
+    '''Draw one profile. The format comes from the extension of filename (eps, png, pdf, ...)
+    [input] : profile (dict of x, y, [macro], [vac_x, vac_y]) or name of .npz, filename, show (open a window)
+    '''
+    if isinstance(profile, str):
+        profile = load_profile(profile)
+    plt = pyplot(show)
+    fig = plt.figure()
+    plt.plot(profile["x"], profile["y"], 'r')
+    if "macro" in profile:
+        plt.plot(profile["x"], profile["macro"], 'k')
+    if "vac_x" in profile:
+        # If there are dipole corrections, selected vacuum region
+        plt.plot(profile["vac_x"], profile["vac_y"], 'bo')
+    fig.savefig(filename)
+    if show:
+        plt.show()
+    plt.close(fig)
+    return filename
+
+
+def _render_job(job):
+    try:
+        return render(*job), None
+    except Exception as error:
+        return job[1], "%s: %s" % (type(error).__name__, error)
+
+
+def render_batch(jobs, workers=1):
+    '''Draw many profiles with [workers] processes.
+    [input] : jobs ([(profile or .npz name, output filename), ...]), workers
+    [output] : [(output filename, error message or None), ...]'''
+    jobs = [(profile, filename) for (profile, filename) in jobs]
+    if workers == 1 or len(jobs) <= 1:
+        return [_render_job(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_render_job, jobs, chunksize=max(1, len(jobs) // (4 * workers))))
+
+
+def main():
+    pars = argparse.ArgumentParser(description="Draw profiles (.npz) saved by gyp.py")
+    pars.add_argument("profiles", type=str, nargs="+", help="* .npz files of gyp.py")
+    pars.add_argument("-f", type=str, default="eps", help="* Format of image (eps, png, pdf, ...). default=eps")
+    pars.add_argument("-j", type=int, default=1, help="Number of worker processes. default=1")
+    args = pars.parse_args()
+
+    jobs = [(name, os.path.splitext(name)[0] + "." + args.f) for name in args.profiles]
+    failed = 0
+    for (filename, error) in render_batch(jobs, args.j):
+        if error is not None:
+            failed += 1
+            print("[FAILED] %s : %s" % (filename, error))
+    print("--------------   %d image(s) done, %d failed   --------------" % (len(jobs) - failed, failed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+import numpy as np
+
+##########################################################################
+## Igor text (.itx) writer                                              ##
+## Several waves and several graphs in one file. Waves of same length   ##
+## are written as columns of one WAVES block, formatted in bulk (one    ##
+## string formatting for many rows) instead of one write per point.     ##
+##########################################################################
+
+ROWS = 1 << 16
+
+
+def format_rows(columns, fmt="%s", sep=" "):
+    '''Columns as text rows, "v1 v2 ...\\n". Values are written as float (WAVES/D).
+    [input] : columns (list of 1D arrays of same length), fmt (format of one value, "%s" = shortest repr), sep
+    [output] : str
+    '''
+    data = np.column_stack([np.asarray(c, dtype="d").ravel() for c in columns])
+    row = sep.join([fmt] * data.shape[1]) + "\n"
+    return "".join((row * len(part)) % tuple(part.ravel().tolist()) for part in
+                   (data[i:i + ROWS] for i in range(0, len(data), ROWS)))
+
+
+def wave_blocks(waves, fmt="%s", sep=" "):
+    '''WAVES/D blocks of [(name, array), ...]. Consecutive waves of same length share one block.
+    [output] : str'''
+    out, group = [], []
+    for (name, values) in list(waves) + [(None, None)]:
+        if group and (name is None or len(values) != len(group[0][1])):
+            out.append("WAVES/D %s\nBEGIN\n" % " ".join(n for (n, v) in group))
+            out.append(format_rows([v for (n, v) in group], fmt, sep))
+            out.append("END\n")
+            group = []
+        if name is not None:
+            group.append((name, values))
+    return "".join(out)
+
+
+def graph_commands(traces, title=None, commands=()):
+    '''Igor commands of one graph.
+    [input] : traces ([(y wave, x wave), ...], first one is displayed, others are appended),
+              title (name of graph), commands (list of Igor commands without "X ", e.g. "ModifyGraph tick=2")
+    [output] : str'''
+    (y, x) = traces[0]
+    out = ["X Display %s vs %s as \"%s\" \n" % (y, x, title if title is not None else y)]
+    out += ["X AppendToGraph %s vs %s\n" % (y, x) for (y, x) in traces[1:]]
+    out += ["X %s\n" % c.rstrip("\n") for c in commands]
+    return "".join(out)
+
+
+def write_itx(filename, waves, graphs=(), fmt="%s", sep=" "):
+    '''Write an Igor text file.
+    [input] : filename,
+              waves : [(name, 1D array), ...]
+              graphs : [(traces, title, commands), ...] (see graph_commands)
+              fmt, sep : format of values (see format_rows)
+    '''
+    with open(filename, "w") as itx:
+        itx.write("IGOR\n")
+        itx.write(wave_blocks(waves, fmt, sep))
+        for (traces, title, commands) in graphs:
+            itx.write(graph_commands(traces, title, commands))
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+import os
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+##########################################################################
+## STM images from the tunneling current of CURSAVE                     ##
+## constant height  : current on one xy plane (z in grid index,         ##
+##                    fractional z is interpolated between planes).     ##
+## constant current : for each (x, y), highest z where current = iso,   ##
+##                    (log-)linear interpolation between grid points.   ##
+## Every image is taken from the grid in memory (one read for all),     ##
+## with a pool of processes which share the grid (fork).                ##
+## Out-of-core (c2c -m) : every image is filled column tile by column   ##
+## tile in one pass over the grid (tiled_images).                       ##
+## $ python stm_image.py --height 10 20 --iso 1e-4 1e-5 -f png -j 4     ##
+##########################################################################
+
+FORMATS = ("png", "npy", "dat")
+
+
+def _height_columns(current, z):
+    '''Current of every column at height z. [input] : current (..., nz) [output] : np.array(dtype='d') with shape (...)'''
+    nz = current.shape[-1]
+    if not 0 <= z <= nz - 1:
+        raise ValueError("height %g is out of the grid (0 ~ %d)" % (z, nz - 1))
+    k = min(int(z), nz - 2) if nz > 1 else 0
+    t = z - k
+    return current[..., k] if t == 0 else (1 - t) * current[..., k] + t * current[..., k + 1]
+
+
+def _current_columns(current, iso):
+    '''Height of the iso-current of every column. [input] : current (..., nz) [output] : np.array(dtype='d') with shape (...)'''
+    nz = current.shape[-1]
+    above = current >= iso
+    found = above.any(axis=-1)
+    k = nz - 1 - np.argmax(above[..., ::-1], axis=-1)
+    del above
+    k1 = np.minimum(k + 1, nz - 1)
+    c0 = np.take_along_axis(current, k[..., None], axis=-1)[..., 0]
+    c1 = np.take_along_axis(current, k1[..., None], axis=-1)[..., 0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log = (c0 > 0) & (c1 > 0) & (iso > 0)
+        f0 = np.where(log, np.log(np.where(log, c0, 1)), c0)
+        f1 = np.where(log, np.log(np.where(log, c1, 1)), c1)
+        fi = np.where(log, np.log(iso) if iso > 0 else 0, iso)
+        t = np.where((k1 > k) & (f1 < f0), (f0 - fi) / (f0 - f1), 0)
+    return np.where(found, k + np.clip(t, 0, 1), np.nan)
+
+
+def constant_height(current, z):
+    '''Constant-height image.
+    [input] : current (nx, ny, nz), z (grid index, 0 <= z <= nz-1)
+    [output] : image @np.array(dtype='d') with shape (ny, nx)
+    '''
+    return np.array(_height_columns(current, z).T)
+
+
+def constant_current(current, iso):
+    '''Constant-current (isosurface height) image, current is assumed to decay along +z.
+    For each column, the highest grid point with current >= iso and the next one are interpolated,
+    linearly in log(current) if both are positive (exponential decay), otherwise linearly.
+    [input] : current (nx, ny, nz), iso
+    [output] : height (grid index) @np.array(dtype='d') with shape (ny, nx), nan where current < iso everywhere
+    '''
+    return _current_columns(current, iso).T
+
+
+def image_name(kind, value, fmt, outdir="."):
+    return os.path.join(outdir, "STM_%s%g.%s" % ({"height": "h", "current": "I"}[kind], value, fmt))
+
+
+def save_image(filename, image, xy=None, label=""):
+    '''Write one image. The format comes from the extension (png, npy, dat).
+    [input] : filename, image (ny, nx), xy : (x, y) positions (nx, ny, 2) for png, label of colorbar
+    '''
+    ext = os.path.splitext(filename)[1][1:]
+    if ext == "npy":
+        np.save(filename, image)
+    elif ext == "dat":
+        np.savetxt(filename, image, fmt="%.10E")
+    else:
+        from gyp_plot import pyplot
+        plt = pyplot()
+        fig = plt.figure()
+        if xy is None:
+            plt.pcolormesh(image, shading="auto", cmap="gray")
+        else:
+            plt.pcolormesh(xy[:, :, 0].T, xy[:, :, 1].T, image, shading="auto", cmap="gray")
+        plt.gca().set_aspect("equal")
+        plt.colorbar(label=label)
+        fig.savefig(filename)
+        plt.close(fig)
+    return filename
+
+
+#------------------------------------------------------------------
+# Batch of images
+#------------------------------------------------------------------
+_SHARED = None
+
+
+def _init_shared(xy, current):
+    global _SHARED
+    _SHARED = (xy, current)
+
+
+def _image_job(job):
+    (kind, value, filename) = job
+    (xy, current) = _SHARED
+    try:
+        if isinstance(current, dict):
+            # images already computed (tiled_images)
+            image = current[job]
+        elif kind == "height":
+            image = constant_height(current, value)
+        else:
+            image = constant_current(current, value)
+        return save_image(filename, image, xy, "current" if kind == "height" else "height (grid)"), None
+    except Exception as error:
+        return filename, "%s: %s" % (type(error).__name__, error)
+
+
+def _jobs(heights, isos, fmt, outdir):
+    jobs = [("height", z, image_name("height", z, fmt, outdir)) for z in heights]
+    return jobs + [("current", iso, image_name("current", iso, fmt, outdir)) for iso in isos]
+
+
+def _run(jobs, xy, current, workers):
+    if workers < 2 or len(jobs) <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+        _init_shared(xy, current)
+        return [_image_job(job) for job in jobs]
+    ctx = multiprocessing.get_context("fork")
+    with ProcessPoolExecutor(min(workers, len(jobs)), mp_context=ctx, initializer=_init_shared,
+                             initargs=(xy, current)) as pool:
+        return list(pool.map(_image_job, jobs))
+
+
+def images(xy, current, heights=(), isos=(), fmt="png", outdir=".", workers=1):
+    '''Constant-height and constant-current images of one grid.
+    The grid is shared with [workers] processes by fork (serial if fork is not available).
+    [input] : xy (nx, ny, 2), current (nx, ny, nz), heights (grid index), isos (current), fmt (png, npy, dat), outdir
+    [output] : [(filename, error message or None), ...]
+    '''
+    return _run(_jobs(heights, isos, fmt, outdir), xy, current, workers)
+
+
+def tiled_images(tiles, nx, ny, heights=(), isos=(), fmt="png", outdir=".", workers=1):
+    '''Same images as images(), from a grid which is given in tiles of consecutive columns (x slowest, as CURSAVE).
+    Every image is computed tile by tile in one pass, so that only one tile of the grid is in memory,
+    then the images are written by [workers] processes.
+    [input] : tiles : iterable of (c0, xy (ncols, 2), current (ncols, nz)) for columns c0 ~ c0+ncols-1, nx, ny,
+              heights, isos, fmt, outdir, workers as images()
+    [output] : [(filename, error message or None), ...]
+    '''
+    jobs = _jobs(heights, isos, fmt, outdir)
+    columns = dict((job, np.empty(nx * ny, dtype="d")) for job in jobs)
+    errors = {}
+    xy = np.empty((nx * ny, 2), dtype="d")
+    for (c0, xy_tile, current) in tiles:
+        c1 = c0 + len(current)
+        xy[c0:c1] = xy_tile
+        for job in jobs:
+            if job in errors:
+                continue
+            try:
+                if job[0] == "height":
+                    columns[job][c0:c1] = _height_columns(current, job[1])
+                else:
+                    columns[job][c0:c1] = _current_columns(current, job[1])
+            except Exception as error:
+                errors[job] = "%s: %s" % (type(error).__name__, error)
+        # drop the tile before the next one is read
+        del xy_tile, current
+    done = dict((job, columns.pop(job).reshape(nx, ny).T) for job in jobs if job not in errors)
+    results = dict(zip(done, _run(list(done), xy.reshape(nx, ny, 2), done, workers)))
+    return [results[job] if job in results else (job[2], errors[job]) for job in jobs]
+
+
+def report(results):
+    '''Print failed images and the number of done ones. [output] : number of failed images'''
+    failed = 0
+    for (filename, error) in results:
+        if error is not None:
+            failed += 1
+            print("[FAILED] %s : %s" % (filename, error))
+    print("--------------   %d STM image(s) done, %d failed   --------------" % (len(results) - failed, failed))
+    return failed
+
+
+def main():
+    import c2c
+    s_t = time.time()
+    pars = argparse.ArgumentParser(description="Constant-height / constant-current STM images from CURSAVE")
+    pars.add_argument('grid', type=int, nargs='*', metavar='X Y Z', help='x, y, z grids. default: found from CURSAVE')
+    pars.add_argument('-i', type=str, default="CURSAVE", help='CURSAVE file. default=CURSAVE')
+    pars.add_argument('--height', type=float, nargs='+', default=[], help='Heights (grid index) of constant-height images')
+    pars.add_argument('--iso', type=float, nargs='+', default=[], help='Currents of constant-current images')
+    pars.add_argument('-f', type=str, default="png", choices=FORMATS, help='Output format. default=png')
+    pars.add_argument('-o', type=str, default=".", help='Output directory. default=.')
+    pars.add_argument('-j', type=int, default=1, help='Number of worker processes. default=1')
+    args = pars.parse_args()
+
+    if len(args.grid) not in (0, 3):
+        pars.error("give X Y Z, or nothing to find them from CURSAVE")
+    grid = tuple(args.grid) or c2c.preflight(args.i)["grid"]
+    if grid is None:
+        pars.error("grid point numbers could not be found from %s. Give X Y Z." % args.i)
+    xy, current = c2c.read_cursave(args.i, *grid)
+    os.makedirs(args.o, exist_ok=True)
+    report(images(xy, current, args.height, args.iso, args.f, args.o, args.j))
+    print("---%s seconds ---" % (time.time() - s_t))
+
+
+if __name__ == "__main__":
+    main()
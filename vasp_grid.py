@@ -0,0 +1,503 @@
+#!/usr/bin/env python
+import os
+import re
+import mmap
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+##########################################################################
+## Shared reader for VASP volumetric files (CHGCAR, CHG, LOCPOT, ...)   ##
+## Used by gyp.py and ws_chg.py                                         ##
+##########################################################################
+
+# Size of one text block which is handed to the numpy parser at once.
+# Only one block (plus its parsed values) is alive at any time.
+CHUNK_SIZE = 1 << 24
+
+# Any letter except the exponent marker ends the numeric block
+# (e.g. "augmentation occupancies", "magnetic moments", ...)
+_STOP = re.compile(rb"[A-DF-Za-df-z]")
+
+
+def read_header(fp):
+    '''Read the structure part and the grid line of a volumetric file.
+    [input] : fp, file object opened in binary mode ('rb') at the beginning of the file.
+    [output] : header @dict
+    |-> name : name of system @str
+    |-> scale : scale @float
+    |-> cell_vec : [x1, y1, z1], [x2, y2, z2], [x3, y3, z3]] @np.array(dtype='d')
+    |-> species : [atom1, atom2, ...] @list(str). Empty for VASP4 format.
+    |-> natoms : [number_of_atom1, number_of_atom2, ...] @list(int)
+    |-> coord_type : "Direct" / "Cartesian" @str
+    |-> coord : coordination of each atoms @np.array(dtype='d')
+    |-> grid : [nx, ny, nz] @list(int)
+    |-> data_offset : byte offset of the first grid value @int
+    After return, fp is positioned at data_offset.
+    '''
+    name = fp.readline().decode().strip()
+    scale = float(fp.readline().split()[0])
+    cell_vec = np.array([fp.readline().split()[:3] for i in range(3)], dtype="d")
+
+    species = fp.readline().decode().split()
+    if all(x.isdigit() for x in species):
+        # VASP4 format : there is no line for the species.
+        natoms, species = list(map(int, species)), []
+    else:
+        natoms = list(map(int, fp.readline().split()))
+
+    coord_read = fp.readline().decode().strip()
+    if coord_read[:1] in "Ss":
+        coord_read = fp.readline().decode().strip()
+    if coord_read[:1] in "CcKk":
+        coord_type = "Cartesian"
+    elif coord_read[:1] in "DdFf":
+        coord_type = "Direct"
+    else:
+        raise IOError("------- Coordination Type Recognition Failed. -------")
+
+    coord = np.array([fp.readline().split()[:3] for i in range(sum(natoms))], dtype="d").reshape(-1, 3)
+
+    # blank line(s) between the positions and the grid line
+    line = fp.readline()
+    while line and not line.strip():
+        line = fp.readline()
+    grid = list(map(int, line.split()[:3]))
+    if len(grid) != 3:
+        raise IOError("------- Grid line is not found. Is it a volumetric file? -------")
+
+    return {"name": name, "scale": scale, "cell_vec": cell_vec, "species": species, "natoms": natoms,
+            "coord_type": coord_type, "coord": coord, "grid": grid, "data_offset": fp.tell()}
+
+
+def iter_values(fp, nvalues, block=None, chunk_size=CHUNK_SIZE):
+    '''Parse [nvalues] numbers from fp and yield them as float64 arrays of length [block].
+    Text is read in chunks of [chunk_size] bytes and converted by numpy in one call per chunk,
+    so that no python object is made per value.
+    Parsing stops after nvalues numbers, or at the first line which contains letters.
+    [input] : fp (binary mode, positioned at the first value), nvalues, block (default=nvalues), chunk_size
+    [output] : generator of np.array(dtype='d'). The same buffer is reused for every block,
+               so copy it if it must be kept after the next iteration.
+    '''
+    if block is None or block > nvalues:
+        block = nvalues
+    out = np.empty(block, dtype="d")
+    filled, count, tail = 0, 0, b""
+    while count < nvalues:
+        data = fp.read(chunk_size)
+        text = tail + data
+        if data:
+            # Cut at the last separator, so that no number is split between two chunks.
+            cut = max(text.rfind(b"\n"), text.rfind(b" "))
+            if cut < 0:
+                tail = text
+                continue
+            text, tail = text[:cut], text[cut:]
+        stop = _STOP.search(text)
+        if stop is not None:
+            text = text[:stop.start()]
+        if text and not text.isspace():
+            vals = np.fromstring(text, dtype="d", sep=" ")
+            pos = 0
+            while pos < vals.size and count < nvalues:
+                n = min(block - filled, vals.size - pos, nvalues - count)
+                out[filled:filled + n] = vals[pos:pos + n]
+                filled, pos, count = filled + n, pos + n, count + n
+                if filled == block or count == nvalues:
+                    yield out[:filled]
+                    filled = 0
+            del vals
+        if stop is not None or not data:
+            break
+    if count < nvalues:
+        raise IOError("------- Only %d of %d grid values were found. -------" % (count, nvalues))
+
+
+def read_values(fp, nvalues, chunk_size=CHUNK_SIZE):
+    '''Parse [nvalues] numbers from fp into one float64 array.'''
+    for values in iter_values(fp, nvalues, chunk_size=chunk_size):
+        return values
+    return np.empty(0, dtype="d")
+
+
+def _token_starts(buf, prev_space=True):
+    '''Positions in buf where a whitespace separated token starts.'''
+    a = np.frombuffer(buf, dtype=np.uint8)
+    space = (a == 32) | (a == 10) | (a == 9) | (a == 13)
+    prev = np.empty_like(space)
+    if prev.size:
+        prev[0] = prev_space
+        prev[1:] = space[:-1]
+    return np.flatnonzero(~space & prev)
+
+
+def _skip_values(fp, offset, nvalues, chunk_size=CHUNK_SIZE):
+    '''Byte offset of the end of the line which holds the [nvalues]-th number after [offset].
+    VASP writes fixed width lines, so the end is computed from the first line and checked.
+    If the check fails, the numbers are counted (without parsing them).'''
+    fp.seek(offset)
+    first = fp.readline()
+    per_line, width = len(first.split()), len(first)
+    if per_line:
+        nlines = -(-nvalues // per_line)
+        last = offset + (nlines - 1) * width
+        fp.seek(last - 1)
+        if nlines == 1 or fp.read(1) == b"\n":
+            line = fp.readline()
+            if len(line.split()) == nvalues - (nlines - 1) * per_line and not _STOP.search(line):
+                return fp.tell()
+
+    fp.seek(offset)
+    seen, pos, prev_space = 0, offset, True
+    while True:
+        buf = fp.read(chunk_size)
+        if not buf:
+            raise IOError("------- Only %d of %d grid values were found. -------" % (seen, nvalues))
+        starts = _token_starts(buf, prev_space)
+        stop = _STOP.search(buf)
+        if stop is not None:
+            starts = starts[starts < stop.start()]
+        if seen + starts.size >= nvalues:
+            fp.seek(pos + starts[nvalues - seen - 1])
+            fp.readline()
+            return fp.tell()
+        if stop is not None:
+            raise IOError("------- Only %d of %d grid values were found. -------" % (seen + starts.size, nvalues))
+        seen, pos, prev_space = seen + starts.size, pos + len(buf), buf[-1:].isspace()
+
+
+def iter_sections(fp):
+    '''Walk through a volumetric file and yield every section with its byte offsets.
+    Grids are skipped without being parsed, so this is cheap even for huge files.
+    [input] : fp, file object opened in binary mode ('rb')
+    [output] : generator of sections @dict
+    |-> kind : "header" / "grid" / "augmentation" / "extra" (e.g. magnetic moments of each atom)
+    |-> offset, end : byte range of the section. For grids, offset is the first value.
+    |-> block : index of the grid which the section belongs to (0=total, 1=magnetization, ...)
+    |-> grid : [nx, ny, nz] (grid) / atom, count : atom index and number of values (augmentation)
+    '''
+    fp.seek(0)
+    header = read_header(fp)
+    grid = header["grid"]
+    nvalues = grid[0] * grid[1] * grid[2]
+    yield {"kind": "header", "offset": 0, "end": header["data_offset"], "block": 0}
+
+    block, offset = 0, header["data_offset"]
+    while offset is not None:
+        end = _skip_values(fp, offset, nvalues)
+        yield {"kind": "grid", "offset": offset, "end": end, "block": block, "grid": grid}
+        fp.seek(end)
+        offset, extra = None, None
+        while True:
+            start = fp.tell()
+            line = fp.readline()
+            if not line:
+                break
+            tokens = line.split()
+            if not tokens:
+                continue
+            if tokens[0] == b"augmentation":
+                if extra is not None:
+                    yield extra
+                    extra = None
+                count = int(tokens[-1])
+                found = 0
+                while found < count:
+                    values = fp.readline()
+                    if not values:
+                        break
+                    found += len(values.split())
+                yield {"kind": "augmentation", "offset": start, "end": fp.tell(), "block": block,
+                       "atom": int(tokens[-2]), "count": count}
+            elif all(x.isdigit() for x in tokens) and list(map(int, tokens)) == grid:
+                block, offset = block + 1, fp.tell()
+                break
+            elif extra is None:
+                extra = {"kind": "extra", "offset": start, "end": fp.tell(), "block": block}
+            else:
+                extra["end"] = fp.tell()
+        if extra is not None:
+            yield extra
+
+
+def index_sections(filename):
+    '''[output] : list of every section of filename (see iter_sections)'''
+    with open(filename, "rb") as fp:
+        return list(iter_sections(fp))
+
+
+def seek_grid(fp, block=0):
+    '''Read the header and move fp to the first value of grid [block]
+    (0=total, 1=magnetization of spin-polarized CHGCAR, 1~3=mx,my,mz of non-collinear CHGCAR).
+    Only the file before that grid is indexed, and no grid is parsed.
+    [output] : header (see read_header). data_offset is the offset of the requested grid.
+    '''
+    fp.seek(0)
+    header = read_header(fp)
+    if block:
+        for section in iter_sections(fp):
+            if section["kind"] == "grid" and section["block"] == block:
+                header["data_offset"] = section["offset"]
+                break
+        else:
+            raise IOError("------- Grid block %d does not exist. -------" % block)
+    fp.seek(header["data_offset"])
+    return header
+
+
+def read_section(filename, section):
+    '''Load only one section (from iter_sections / index_sections) of filename.
+    [output] : grid section -> np.array(dtype='d') with shape (nz, ny, nx)
+               augmentation section -> np.array(dtype='d')
+               header / extra section -> raw text @str
+    '''
+    with open(filename, "rb") as fp:
+        fp.seek(section["offset"])
+        if section["kind"] == "grid":
+            nx, ny, nz = section["grid"]
+            return read_values(fp, nx * ny * nz).reshape(nz, ny, nx)
+        text = fp.read(section["end"] - section["offset"])
+    if section["kind"] == "augmentation":
+        return np.array(text.split()[4:], dtype="d")
+    return text.decode()
+
+
+_SHARED = None
+
+
+def _init_shared(buf):
+    global _SHARED
+    _SHARED = np.frombuffer(buf, dtype="d")
+
+
+def _count_range(filename, start, end):
+    with open(filename, "rb") as fp:
+        fp.seek(start)
+        return _token_starts(fp.read(end - start)).size
+
+
+def _parse_range(filename, start, end, dest, count):
+    with open(filename, "rb") as fp:
+        fp.seek(start)
+        text = fp.read(end - start)
+    values = np.fromstring(text, dtype="d", sep=" ") if text.strip() else np.empty(0)
+    if values.size != count:
+        return False
+    _SHARED[dest:dest + count] = values
+    return True
+
+
+def _split_ranges(fp, offset, end, nvalues, nranges):
+    '''Split the byte range of a grid into [nranges] ranges which start at the beginning of a line.
+    [output] : [(start, end, count), ...] where count is the number of values,
+               or [(start, end, None), ...] if the lines are not of the same width.'''
+    fp.seek(offset)
+    first = fp.readline()
+    per_line, width = len(first.split()), len(first)
+    nlines = -(-nvalues // per_line) if per_line else 0
+    if nlines and 0 < end - offset - (nlines - 1) * width <= width:
+        step = -(-nlines // nranges)
+        ranges = []
+        for i in range(0, nlines, step):
+            ranges.append((offset + i * width, min(offset + (i + step) * width, end), min(step, nlines - i) * per_line))
+        ranges[-1] = ranges[-1][:2] + (nvalues - sum(r[2] for r in ranges[:-1]),)
+        return ranges
+
+    bounds = [offset]
+    for i in range(1, nranges):
+        fp.seek(offset + (end - offset) * i // nranges)
+        fp.readline()
+        if bounds[-1] < fp.tell() < end:
+            bounds.append(fp.tell())
+    bounds.append(end)
+    return [(bounds[i], bounds[i + 1], None) for i in range(len(bounds) - 1)]
+
+
+def read_values_parallel(filename, offset, nvalues, workers=None):
+    '''Parse the grid which starts at byte [offset] of filename with a pool of processes.
+    The numeric block is split into line-aligned byte ranges, and each worker parses its ranges
+    directly into one shared memory array (anonymous mmap, inherited by fork).
+    Falls back to read_values if fork is not available.
+    [input] : filename, offset, nvalues, workers (default=number of cores)
+    [output] : np.array(dtype='d') of length nvalues
+    '''
+    workers = workers or os.cpu_count() or 1
+    with open(filename, "rb") as fp:
+        end = _skip_values(fp, offset, nvalues)
+        if workers < 2 or "fork" not in multiprocessing.get_all_start_methods():
+            fp.seek(offset)
+            return read_values(fp, nvalues)
+        ranges = _split_ranges(fp, offset, end, nvalues, max(workers * 4, (end - offset) // CHUNK_SIZE + 1))
+
+    buf = mmap.mmap(-1, max(nvalues * 8, 1))
+    ctx = multiprocessing.get_context("fork")
+    with ProcessPoolExecutor(workers, mp_context=ctx, initializer=_init_shared, initargs=(buf,)) as pool:
+        for attempt in range(2):
+            if ranges[0][2] is None:
+                counts = list(pool.map(_count_range, [filename] * len(ranges), [r[0] for r in ranges], [r[1] for r in ranges]))
+                ranges = [r[:2] + (c,) for (r, c) in zip(ranges, counts)]
+            if sum(r[2] for r in ranges) != nvalues:
+                raise IOError("------- %d values were found instead of %d. -------" % (sum(r[2] for r in ranges), nvalues))
+            dest = np.cumsum([0] + [r[2] for r in ranges[:-1]]).tolist()
+            done = pool.map(_parse_range, [filename] * len(ranges), [r[0] for r in ranges], [r[1] for r in ranges], dest, [r[2] for r in ranges])
+            if all(done):
+                break
+            # Lines were not of the same width after all. Count the values in each range.
+            ranges = [r[:2] + (None,) for r in ranges]
+        else:
+            raise IOError("------- Grid could not be parsed in parallel. -------")
+    return np.frombuffer(buf, dtype="d")[:nvalues]
+
+
+def read_grid(filename, block=0, workers=1):
+    '''Read the header and one grid of a volumetric file.
+    [input] : filename, block (0=total, 1=magnetization, ... see seek_grid), workers (>1 : read_values_parallel)
+    [output] : header (see read_header), grid data @np.array(dtype='d') with shape (nz, ny, nx)
+    '''
+    with open(filename, "rb") as fp:
+        header = seek_grid(fp, block)
+        nx, ny, nz = header["grid"]
+        if workers != 1:
+            data = read_values_parallel(filename, header["data_offset"], nx * ny * nz, workers)
+        else:
+            data = read_values(fp, nx * ny * nz)
+    return header, data.reshape(nz, ny, nx)
+
+
+def planar_averages(slabs, grid):
+    '''Planar averages along a, b and c, built in one pass over the xy planes.
+    Only one plane is needed at a time, so a grid larger than memory can be averaged
+    while it is being read (slabs=iter_values(fp, nx*ny*nz, nx*ny)).
+    [input] : slabs, iterable of xy planes in z order (nx*ny values each, x fastest). grid=[nx, ny, nz]
+    [output] : [avg_a, avg_b, avg_c] @list(np.array(dtype='d'))
+    '''
+    nx, ny, nz = grid
+    sum_a, sum_b, avg_c = np.zeros(nx), np.zeros(ny), np.zeros(nz)
+    k = 0
+    for slab in slabs:
+        slab = np.reshape(slab, (ny, nx))
+        sum_a += slab.sum(axis=0)
+        row = slab.sum(axis=1)
+        sum_b += row
+        avg_c[k] = row.sum() / (nx * ny)
+        k += 1
+    return [sum_a / (ny * nz), sum_b / (nx * nz), avg_c]
+
+
+def format_header(header):
+    '''Header part of a volumetric file (structure + grid line) from a header dict (see read_header).
+    [output] : text @bytes'''
+    lines = [header["name"], "   %.14f" % header["scale"]]
+    lines += ["  %12.6f%12.6f%12.6f" % tuple(v) for v in header["cell_vec"]]
+    if header["species"]:
+        lines.append("   " + "   ".join(header["species"]))
+    lines += ["   " + "   ".join(map(str, header["natoms"])), header["coord_type"]]
+    lines += ["  %10.6f%10.6f%10.6f" % tuple(v) for v in header["coord"]]
+    lines += ["", "  %d  %d  %d" % tuple(header["grid"]), ""]
+    return "\n".join(lines).encode()
+
+
+# Number of values formatted at once by write_values
+WRITE_CHUNK = 1 << 20
+_POW10 = np.array([10.0**k for k in range(-120, 121)])
+
+
+def _format_python(values, per_line):
+    lines = []
+    for i in range(0, len(values), per_line):
+        lines.append("".join(" %18.11E" % x for x in values[i:i + per_line]) + "\n")
+    return "".join(lines).encode()
+
+
+def format_values(values, per_line=5):
+    '''Format numbers as VASP grid lines, [per_line] numbers per line, each as " %18.11E".
+    The characters are built with numpy arithmetic instead of one python format call per number.
+    [input] : values @np.array(dtype='d'), per_line
+    [output] : text @bytes
+    '''
+    x = np.asarray(values, dtype="d").reshape(-1)
+    n = x.size
+    if n == 0:
+        return b""
+    a = np.abs(x)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        e = np.floor(np.log10(np.where(a > 0, a, 1.0)))
+    if not np.isfinite(a).all() or np.abs(e).max() > 98:
+        return _format_python(x, per_line)
+    e = e.astype(np.int64)
+    scaled = a * _POW10[11 - e + 120]
+    digits = np.rint(scaled).astype(np.int64)
+    tie = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-3
+    # log10 can be off by one near powers of 10, and rounding can give 10.00000000000
+    for fix in (digits >= 10**12, (digits < 10**11) & (a > 0)):
+        if fix.any():
+            e[fix] += np.where(digits[fix] >= 10**12, 1, -1)
+            scaled[fix] = a[fix] * _POW10[11 - e[fix] + 120]
+            digits[fix] = np.rint(scaled[fix]).astype(np.int64)
+    # The last digit of numbers near a rounding tie is taken from python (correctly rounded)
+    tie |= np.abs(scaled - np.floor(scaled) - 0.5) < 1e-3
+    for i in np.flatnonzero(tie):
+        text = "%.11E" % a[i]
+        digits[i], e[i] = int(text[0] + text[2:13]), int(text[14:])
+
+    # One row per character (contiguous), transposed to one row per number at the end.
+    buf = np.empty((19, n), dtype=np.uint8)
+    buf[0] = ord(" ")
+    buf[1] = np.where(np.signbit(x), ord("-"), ord(" "))
+    hi, lo = (digits // 10**6).astype(np.int32), (digits % 10**6).astype(np.int32)
+    for (part, cols) in ((lo, range(14, 8, -1)), (hi, range(8, 3, -1))):
+        for col in cols:
+            q = part // 10
+            buf[col] = part - q * 10
+            part = q
+    buf[2] = hi // 10**5
+    buf[2] += 48
+    buf[4:15] += 48
+    buf[3] = ord(".")
+    buf[15] = ord("E")
+    buf[16] = np.where(e < 0, ord("-"), ord("+"))
+    e = np.abs(e)
+    buf[17] = 48 + e // 10
+    buf[18] = 48 + e % 10
+    buf = buf.T
+
+    full = n - n % per_line
+    lines = np.empty((full // per_line, per_line * 19 + 1), dtype=np.uint8)
+    lines[:, :-1] = buf[:full].reshape(-1, per_line * 19)
+    lines[:, -1] = ord("\n")
+    text = lines.tobytes()
+    if full < n:
+        text += buf[full:].tobytes() + b"\n"
+    return text
+
+
+def write_values(out, blocks, per_line=5, chunk=WRITE_CHUNK):
+    '''Write consecutive blocks of numbers as VASP grid lines (see format_values).
+    Lines continue across blocks, and at most [chunk] numbers are formatted at once (~100 bytes of buffers per number).
+    [input] : out, file object opened in binary mode ('wb', or gzip.open(..., 'wb')). blocks, iterable of arrays.
+    '''
+    carry = np.empty(0, dtype="d")
+    for values in blocks:
+        values = np.asarray(values).reshape(-1)
+        if carry.size:
+            k = min(per_line - carry.size, values.size)
+            carry, values = np.concatenate([carry, values[:k]]), values[k:]
+            if carry.size < per_line:
+                continue
+            out.write(format_values(carry, per_line))
+        full = values.size - values.size % per_line
+        step = max(chunk - chunk % per_line, per_line)
+        for i in range(0, full, step):
+            out.write(format_values(values[i:min(i + step, full)], per_line))
+        carry = values[full:].copy()
+    if carry.size:
+        out.write(format_values(carry, per_line))
+
+
+if __name__ == "__main__":
+    import sys
+    for filename in sys.argv[1:]:
+        print("--------------  %s  --------------" % filename)
+        for section in index_sections(filename):
+            print("%-13s block=%d  bytes [%d, %d)  %s" % (section["kind"], section["block"], section["offset"], section["end"],
+                  section.get("grid", "") or ("atom=%d count=%d" % (section["atom"], section["count"]) if "atom" in section else "")))
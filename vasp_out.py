@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+import os
+import re
+import sys
+import mmap
+import xml.etree.ElementTree as ET
+
+##########################################################################
+## Readers of VASP text outputs (OUTCAR, vasprun.xml, ...).             ##
+## Most values printed at every ionic step (E-fermi, TOTEN, ...) are    ##
+## needed only for the final step, so they are searched from the end    ##
+## of the file : only the tail after the last match is read.            ##
+## vasprun.xml too : it is parsed only if the tail search fails.        ##
+##########################################################################
+
+# name : (keyword, index of the value in line.split()) for "last value wins" quantities
+KEYWORDS = {
+    "fermi": ("E-fermi", 2),
+    "toten": ("free  energy   TOTEN", 4),
+    "energy": ("energy  without entropy", 3),
+    "energy_sigma0": ("energy  without entropy", 6),
+    "volume": ("volume of cell", 4),
+    "nelect": ("number of electron", 3),
+    "magnetization": ("number of electron", 5),
+}
+
+# name : name attribute of <i> in vasprun.xml
+VASPRUN_KEYS = {
+    "fermi": "efermi",
+    "toten": "e_fr_energy",
+    "energy": "e_wo_entrp",
+    "energy_sigma0": "e_0_energy",
+    "volume": "volume",
+}
+
+
+def find_last(filename, keyword):
+    '''Last line of filename which contains keyword.
+    The file is memory-mapped and searched backward from the end, so the pages before the match are never read.
+    [input] : filename, keyword (str)
+    [output] : the line (str, without newline) or None if keyword is not in the file
+    '''
+    key = keyword.encode() if isinstance(keyword, str) else keyword
+    with open(filename, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos = mm.rfind(key)
+            if pos < 0:
+                return None
+            start = mm.rfind(b"\n", 0, pos) + 1
+            end = mm.find(b"\n", pos)
+            return mm[start:end if end >= 0 else len(mm)].decode(errors="replace").rstrip("\r")
+
+
+def last_value(filename, keyword, index, dtype=float):
+    '''[output] : dtype(line.split()[index]) of the last line with keyword, or None if keyword is not in the file'''
+    line = find_last(filename, keyword)
+    if line is None:
+        return None
+    return dtype(line.split()[index])
+
+
+def last_values(filename="OUTCAR", names=None):
+    '''Final value of every quantity of KEYWORDS (or of [names]).
+    [output] : dict of name : value (None if it is not in the file)'''
+    out = {}
+    for name in (KEYWORDS if names is None else names):
+        keyword, index = KEYWORDS[name]
+        try:
+            out[name] = last_value(filename, keyword, index)
+        except (IndexError, ValueError):
+            out[name] = None
+    return out
+
+
+def vasprun_last(filename, name):
+    '''Last <i name="[name]"> of vasprun.xml by the tail-first search (see find_last), without parsing the file.
+    [input] : filename, name (name attribute, e.g. "efermi")
+    [output] : float, or None if it is not found or not complete on its line (truncated file, ...)
+    '''
+    line = find_last(filename, 'name="%s"' % name)
+    if line is None:
+        return None
+    values = re.findall(r'<i\b[^>]*\bname="%s"[^>]*>([^<]*)</i>' % re.escape(name), line)
+    try:
+        return float(values[-1]) if values else None
+    except ValueError:
+        return None
+
+
+def vasprun_values(filename="vasprun.xml", names=None, tail=True):
+    '''Final value of scalar results (<i name=...>) of vasprun.xml.
+    Each value is searched from the end of the file first (see vasprun_last, tail=True),
+    and the file is parsed only for the names which are not found this way.
+    The parse is incremental with constant memory : every element is removed from its parent when it ends,
+    so nothing of the tree is kept. A truncated file (running calculation) gives the values up to where it stops.
+    [input] : filename, names (list of names of VASPRUN_KEYS, None = every name), tail
+    [output] : dict of name : value (None if it is not in the file)
+    '''
+    names = list(VASPRUN_KEYS) if names is None else names
+    out = dict.fromkeys(names)
+    if tail:
+        for name in names:
+            out[name] = vasprun_last(filename, VASPRUN_KEYS[name])
+    wanted = dict((VASPRUN_KEYS[name], name) for name in names if out[name] is None)
+    if not wanted:
+        return out
+    stack = []
+    try:
+        for (event, elem) in ET.iterparse(filename, events=("start", "end")):
+            if event == "start":
+                stack.append(elem)
+                continue
+            stack.pop()
+            if elem.tag == "i":
+                name = wanted.get(elem.get("name"))
+                if name is not None:
+                    try:
+                        out[name] = float(elem.text)
+                    except (TypeError, ValueError):
+                        pass
+            if stack:
+                # only one finished child is attached at a time, so remove() finds it at once
+                stack[-1].remove(elem)
+    except ET.ParseError:
+        pass
+    return out
+
+
+def fermi_energy(filename="OUTCAR"):
+    '''[output] : Fermi energy of the final step (eV). From vasprun.xml if the name ends with .xml. None if not found.'''
+    if filename.endswith(".xml"):
+        return vasprun_values(filename, ["fermi"])["fermi"]
+    return last_value(filename, *KEYWORDS["fermi"])
+
+
+if __name__ == "__main__":
+    for filename in sys.argv[1:] or ["OUTCAR"]:
+        print("* %s" % filename)
+        values = vasprun_values(filename) if filename.endswith(".xml") else last_values(filename)
+        for (name, value) in values.items():
+            print("  %-15s %s" % (name, value))
@@ -2,53 +2,37 @@
 import numpy as np
 import argparse
 import sys
-from decimal import Decimal
-
-def chgcar_read(chgfile):
-    with open(chgfile, "r") as chg:
-        celldata = []
-        pos = []
-        name = chg.readline().strip()
-        scale = chg.readline().strip()
-        for i in range(3):
-            celldata.append(chg.readline().strip().split())
-        celldata = np.array(celldata, dtype="d")
-        elements = chg.readline().strip()
-        numelem = chg.readline().strip()
-
-        numatom = 0
-        for x in numelem.split():
-            numatom += int(x)
-
-        coord_type = chg.readline().strip()
-
-        for i in range(numatom):
-            pos.append(chg.readline().strip().split())
-        pos = np.array(pos, dtype="d")
-
-        chg.readline()
-
-        vol = np.dot(celldata[0], np.cross(celldata[1], celldata[2]))
-        header = [name, scale, celldata, elements, numelem, coord_type, pos]
-
-        ## Header finished, now chg data lines
-        grid = chg.readline().strip().split()
-
-        lines = chg.readlines()
-
-        chglist = []
-        for x in lines:
-            if "a" in x:
-                break
-            else:
-                tmp = x.split()
-                for y in tmp:
-                    chglist.append(y)
-
-        chglist = np.reshape(np.array(chglist, dtype="d"), (int(grid[2]), int(grid[1]), int(grid[0])))
-        return [chglist, grid, header, vol]
-
-def planar_avg(chgdata, direction):
+import gzip
+import grid_cache
+import vasp_grid
+import grid_archive
+import igor_itx
+
+# Number of grid values held in memory by stream_differences (all input files together)
+STREAM_CHUNK = 1 << 20
+
+def header_list(header):
+    celldata, pos = header["cell_vec"], header["coord"]
+    elements = " ".join(header["species"])
+    numelem = " ".join(map(str, header["natoms"]))
+    vol = np.dot(celldata[0], np.cross(celldata[1], celldata[2]))
+    return [header["name"], str(header["scale"]), celldata, elements, numelem, header["coord_type"], pos], vol
+
+def chgcar_read(chgfile, use_cache=True, cache_max=grid_cache.MAX_SIZE, block=0, nproc=1):
+    header, chglist = grid_cache.read_grid(chgfile, use_cache, cache_max, block, nproc)
+    grid = header["grid"]
+    header, vol = header_list(header)
+    return [chglist, grid, header, vol]
+
+def planar_read(chgfile, use_cache=True, cache_max=grid_cache.MAX_SIZE, block=0):
+    # Same as chgcar_read, but only [avg_a, avg_b, avg_c] is kept instead of the grid.
+    header, avgs = grid_cache.read_planar_averages(chgfile, use_cache, cache_max, block)
+    grid = header["grid"]
+    header, vol = header_list(header)
+    return [avgs, grid, header, vol]
+
+def planar_avg(chgdata, direction, streamed=False):
+    # streamed=True : chgdata[0] is [avg_a, avg_b, avg_c] from planar_read
     avgdata = []
     x_avgdata = []
     if direction in "cCzZ3":
@@ -58,7 +42,7 @@ def planar_avg(chgdata, direction):
             else:
                 x_avgdata.append(i / int(chgdata[1][2]))
         x_avgdata = np.array(x_avgdata)
-        avgdata = np.mean(chgdata[0], axis=(1, 2))
+        avgdata = chgdata[0][2] if streamed else np.mean(chgdata[0], axis=(1, 2))
         x_avgdata *= np.linalg.norm(chgdata[2][2][2] * float(chgdata[2][1]))
 
     elif direction in "bByY2":
@@ -68,7 +52,7 @@ def planar_avg(chgdata, direction):
             else:
                 x_avgdata.append(i / int(chgdata[1][1]))
         x_avgdata = np.array(x_avgdata)
-        avgdata = np.mean(chgdata[0], axis=(0, 2))
+        avgdata = chgdata[0][1] if streamed else np.mean(chgdata[0], axis=(0, 2))
         x_avgdata *= np.linalg.norm(chgdata[2][2][1] * float(chgdata[2][1]))
 
     elif direction in "aAxX1":
@@ -78,7 +62,7 @@ def planar_avg(chgdata, direction):
             else:
                 x_avgdata.append(i / int(chgdata[1][0]))
         x_avgdata = np.array(x_avgdata)
-        avgdata = np.mean(chgdata[0], axis=(0, 1))
+        avgdata = chgdata[0][0] if streamed else np.mean(chgdata[0], axis=(0, 1))
         x_avgdata *= np.linalg.norm(chgdata[2][2][0] * float(chgdata[2][1]))
 
     return [avgdata, x_avgdata]
@@ -90,70 +74,118 @@ def differences(chgdata1, chgdata2):
         raise IOError("Grid not matching!")
     return chgdata1
 
-def exportdata(chgdata, outfile):
-    with open(outfile, "w") as out:
-        for x in chgdata[2]:
-            if type(x) is np.ndarray:
-                for y in x:
-                    out.write("%12.10f   %12.10f   %12.10f" %(y[0], y[1], y[2]))
-                    out.write("\n")
-            else:
-                out.write(x)
-                out.write("\n")
-        out.write("\n")
-        out.write("%4s  %4s  %4s" % (chgdata[1][0], chgdata[1][1], chgdata[1][2]))
-        out.write("\n")
-        chgdata[0] = chgdata[0].flatten()
-        tmp = []
-        for x in chgdata[0]:
-            tmp.append("%14s" % ('{:>14.12E}'.format(Decimal(x))))
-        out.write("   ".join(tmp))
+def write_header(out, header, grid):
+    lines = []
+    for x in header:
+        if type(x) is np.ndarray:
+            for y in x:
+                lines.append("%12.10f   %12.10f   %12.10f\n" %(y[0], y[1], y[2]))
+        else:
+            lines.append(x + "\n")
+    lines.append("\n")
+    lines.append("%4s  %4s  %4s\n" % (grid[0], grid[1], grid[2]))
+    out.write("".join(lines).encode())
+
+def open_output(outfile, compress=False):
+    # Binary output file. With compress (or a .gz name), it is gzip-compressed while being written.
+    if compress or outfile.endswith(".gz"):
+        if not outfile.endswith(".gz"):
+            outfile += ".gz"
+        return gzip.open(outfile, "wb", compresslevel=3)
+    return open(outfile, "wb")
+
+def header_dict(header, grid):
+    # header list (see header_list) -> header dict of vasp_grid
+    return {"name": header[0], "scale": float(header[1]), "cell_vec": header[2], "species": header[3].split(),
+            "natoms": list(map(int, header[4].split())), "coord_type": header[5], "coord": header[6], "grid": list(grid)}
+
+def exportdata(chgdata, outfile, compress=False):
+    if outfile.endswith(".vgrid"):
+        # compressed binary archive, read back with grid_archive.py
+        grid_archive.write_archive(outfile, header_dict(chgdata[2], chgdata[1]), [chgdata[0]])
+        return
+    with open_output(outfile, compress) as out:
+        write_header(out, chgdata[2], chgdata[1])
+        vasp_grid.write_values(out, [chgdata[0]])
+
+def stream_differences(infiles, outfile, use_cache=True, block=0, chunk=STREAM_CHUNK, compress=False):
+    # infiles[0] - infiles[1] - infiles[2] - ..., read in lockstep and written block by block.
+    # Every file gets chunk / (number of files) values, so memory does not grow with the number of files.
+    # Text chunks of the parsers are as large as their blocks (8 bytes per value), and at most chunk // 16
+    # values are formatted at once (about 100 bytes each), so memory is a few times chunk * 8 bytes.
+    size = max(chunk // len(infiles), 1)
+    headers, iters = [], []
+    for x in infiles:
+        header, values = grid_cache.iter_grid(x, size, use_cache, block, chunk_size=max(size * 8, 1 << 16))
+        headers.append(header)
+        iters.append(values)
+    grid = headers[0]["grid"]
+    for header in headers[1:]:
+        if header["grid"] != grid:
+            raise IOError("Grid not matching!")
+
+    def combined():
+        result = np.empty(size, dtype="d")
+        for values in iters[0]:
+            n = values.size
+            result[:n] = values
+            for other in iters[1:]:
+                result[:n] -= next(other)
+            yield result[:n]
+
+    if outfile.endswith(".vgrid"):
+        grid_archive.write_archive(outfile, headers[0], combined())
+        return
+    with open_output(outfile, compress) as out:
+        write_header(out, header_list(headers[0])[0], grid)
+        vasp_grid.write_values(out, combined(), chunk=max(chunk // 16, 1024))
 
 def plotplanar(planardata, outfile, prefix):
-
-    def graphpreset(outfile, leftmin, leftmax, botmin, botmax, width=340.157, height=340.157):
-        # Writing the header part of .itx
-        preset = ("X DefaultFont/U \"Times New Roman\"\n"
-                  "X ModifyGraph marker=19\n"
-                  "X ModifyGraph lSize=1.5\n"
-                  "X ModifyGraph tick=2\n"
-                  "X ModifyGraph mirror=1\n"
-                  "X ModifyGraph fSize=28\n"
-                  "X ModifyGraph lblMargin(left)=15,lblMargin(bottom)=10\n"
-                  "X ModifyGraph standoff=0\n"
-                  "X ModifyGraph axThick=1.5\n"
-                  "X ModifyGraph axisOnTop=1\n"
-                  "X Label left \"Planar averaged ρ (\\f02e\\f00/Å\S3\M)\"\n"
-                  "X Label bottom \"Distance (Å)\"\n"
-                  )
-
-        outfile.write(preset)
-
-        outfile.write("X ModifyGraph width=%f,height=%f\n" % (width, height))
-
-        if leftmin is not None:
-            leftaxis = ("X Setaxis left %4f, %4f\n" % (leftmin, leftmax))
-            outfile.write(leftaxis)
-        if botmin is not None:
-            botaxis = ("X Setaxis bottom %4f, %4f\n" % (botmin, botmax))
-            outfile.write(botaxis)
-
-    with open(outfile, "w") as out:
-        out.write("IGOR\n")
-        out.write("WAVES/D planar_%s x_planar_%s\n" % (prefix, prefix))
-        out.write("BEGIN\n")
-        for i in range(len(planardata[0])):
-            out.write("%12.10f  %12.10f \n" % (planardata[0][i], planardata[1][i]))
-        out.write("END\n")
-
-        out.write("X Display planar_%s vs x_planar_%s as \"planar_avg_%s\" \n" %(prefix, prefix, prefix))
-
-        graphpreset(out, None, None, None, None)
+    # Igor commands of the graph
+    preset = ["DefaultFont/U \"Times New Roman\"",
+              "ModifyGraph marker=19",
+              "ModifyGraph lSize=1.5",
+              "ModifyGraph tick=2",
+              "ModifyGraph mirror=1",
+              "ModifyGraph fSize=28",
+              "ModifyGraph lblMargin(left)=15,lblMargin(bottom)=10",
+              "ModifyGraph standoff=0",
+              "ModifyGraph axThick=1.5",
+              "ModifyGraph axisOnTop=1",
+              "Label left \"Planar averaged ρ (\\f02e\\f00/Å\\S3\\M)\"",
+              "Label bottom \"Distance (Å)\"",
+              "ModifyGraph width=%f,height=%f" % (340.157, 340.157)]
+    waves = [("planar_%s" % prefix, planardata[0]), ("x_planar_%s" % prefix, planardata[1])]
+    graph = ([("planar_%s" % prefix, "x_planar_%s" % prefix)], "planar_avg_%s" % prefix, preset)
+    igor_itx.write_itx(outfile, waves, [graph], fmt="%12.10f", sep="  ")
 
 def executefunc(args):
+    if args.clearcache is True:
+        grid_cache.clear_cache()
+
+    if args.planar is True and args.stream is True:
+        # planar average is linear, so the average of the difference is the difference of the averages.
+        datalist = []
+        for x in args.infile:
+            datalist.append(planar_read(x, not args.nocache, int(args.cachemax * 1024**3), args.block))
+        for i in range(1, len(datalist)):
+            if datalist[0][1] != datalist[i][1]:
+                raise IOError("Grid not matching!")
+            for j in range(3):
+                datalist[0][0][j] = datalist[0][0][j] - datalist[i][0][j]
+        planar = planar_avg(datalist[0], args.direction, streamed=True)
+        if args.novolumeavg is not True:
+            planar[0] = planar[0] / datalist[0][3]
+        plotplanar(planar, args.outitx, args.prefix)
+        return
+
+    if args.planar is not True and args.stream is True:
+        stream_differences(args.infile, args.outfile, not args.nocache, args.block, compress=args.gzip)
+        return
+
     datalist = []
     for x in args.infile:
-        datalist.append(chgcar_read(x))
+        datalist.append(chgcar_read(x, not args.nocache, int(args.cachemax * 1024**3), args.block, args.nproc))
 
     if len(datalist) > 1:
         for i in range(len(datalist)):
@@ -167,11 +199,11 @@ def executefunc(args):
         if args.novolumeavg is True:
             pass
         else:
-            planar /= datalist[0][3]
+            planar[0] = planar[0] / datalist[0][3]
         plotplanar(planar, args.outitx, args.prefix)
 
     else:
-        exportdata(datalist[0], args.outfile)
+        exportdata(datalist[0], args.outfile, args.gzip)
 
 
 def main():
@@ -184,6 +216,13 @@ def main():
     parser.add_argument("-d", dest="direction", type=str, default="z")
     parser.add_argument("-p", dest="planar", action="store_true")
     parser.add_argument("-v", dest="novolumeavg", action="store_true")
+    parser.add_argument("-S", dest="stream", action="store_true")
+    parser.add_argument("-b", dest="block", type=int, default=0)
+    parser.add_argument("-z", dest="gzip", action="store_true")
+    parser.add_argument("-j", dest="nproc", type=int, default=1)
+    parser.add_argument("--nocache", dest="nocache", action="store_true")
+    parser.add_argument("--clear_cache", dest="clearcache", action="store_true")
+    parser.add_argument("--cache_max", dest="cachemax", type=float, default=20)
     parser.set_defaults(func=executefunc)
     args = parser.parse_args()
 